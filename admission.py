@@ -0,0 +1,97 @@
+"""
+Admission control for incoming commands
+- token buckets per user, per channel and global
+- idle buckets are evicted periodically
+"""
+
+import time
+from typing import Optional
+
+SWEEP_PERIOD = 60  # Seconds between evictions of idle buckets
+
+
+class TokenBucketLimiter():
+    """
+    Token buckets keyed by any hashable value.
+    Each bucket is a [tokens, last update] pair,
+    tokens go below zero when a command costs more than is left.
+    """
+
+    def __init__(self, per_minute: float, burst: int):
+        self._rate = per_minute / 60
+        self._burst = burst
+        self._buckets = {}
+        self._last_sweep = time.monotonic()
+
+    def available(self, key, now: float) -> float:
+        """
+        Refill the bucket for key and return its tokens
+        """
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self._burst, now]
+        else:
+            bucket[0] = min(self._burst, bucket[0] + (now - bucket[1]) * self._rate)
+            bucket[1] = now
+        return bucket[0]
+
+    def consume(self, key, tokens: int = 1) -> None:
+        """
+        Take tokens from a bucket refilled by available()
+        """
+        self._buckets[key][0] -= tokens
+
+    def evict_idle(self, now: float) -> None:
+        """
+        Drop the buckets that have refilled completely,
+        they behave the same as a new bucket
+        """
+        if now - self._last_sweep < SWEEP_PERIOD:
+            return
+        self._last_sweep = now
+        self._buckets = {key: bucket for key, bucket in self._buckets.items()
+                         if bucket[0] + (now - bucket[1]) * self._rate < self._burst}
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class AdmissionControl():
+    """
+    A command is admitted only if the user, channel and global buckets all have a token.
+    It is then charged its cost in every bucket.
+    """
+
+    def __init__(self, user: tuple, channel: tuple, overall: tuple):
+        self._limiters = {
+            'user': TokenBucketLimiter(*user),
+            'channel': TokenBucketLimiter(*channel),
+            'global': TokenBucketLimiter(*overall),
+        }
+        self._rejected = {scope: 0 for scope in self._limiters}
+
+    def admit(self, user_id, channel_id, cost: int = 1) -> Optional[str]:
+        """
+        Returns None if the command is admitted,
+        or the scope of the first bucket that is empty.
+        A cost above the remaining tokens is taken as debt, delaying later commands.
+        """
+        now = time.monotonic()
+        keys = {'user': user_id, 'channel': channel_id, 'global': None}
+        for scope, limiter in self._limiters.items():
+            limiter.evict_idle(now)
+            if limiter.available(keys[scope], now) < 1:
+                self._rejected[scope] += 1
+                return scope
+        for scope, limiter in self._limiters.items():
+            limiter.consume(keys[scope], cost)
+        return None
+
+    def metrics(self) -> dict:
+        """
+        Rejected commands per scope and tracked buckets per scope
+        """
+        return {
+            'rejected_total': dict(self._rejected),
+            'buckets': {scope: len(limiter) for scope, limiter in self._limiters.items()},
+        }
@@ -4,22 +4,48 @@ binary utility functions
 - query tx
 - node status
 - tx bank send
+- query auth account
+- keys export
+- tx bank send (simulation)
+- query feemarket gas-price
 """
 
+import itertools
 import json
+import re
 import subprocess
 import logging
 
+import tracing
+
+BINARY_TIMEOUT = 30  # Seconds before a binary call is killed
+
+
+def _run(args: list, **kwargs):
+    """
+    subprocess.run recorded as a span of the current trace.
+    Raises TimeoutError if the binary does not exit within BINARY_TIMEOUT,
+    so a hung node does not hold the calling thread indefinitely.
+    """
+    words = itertools.takewhile(lambda arg: re.fullmatch(r'[a-z-]+', arg), args[1:4])
+    name = 'binary ' + ' '.join(words) + (' (dry run)' if '--dry-run' in args else '')
+    with tracing.span(name):
+        try:
+            return subprocess.run(args, timeout=BINARY_TIMEOUT, **kwargs)
+        except subprocess.TimeoutExpired as ex:
+            logging.error('%s timed out after %s seconds', name, BINARY_TIMEOUT)
+            raise TimeoutError(f'{name} timed out') from ex
+
 
 def check_address(address: str, binary: str):
     """
     gaiad keys parse <address>
     """
-    check = subprocess.run([binary, "keys", "parse",
-                            f"{address}",
-                            '--output=json'],
-                           stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                           text=True)
+    check = _run([binary, "keys", "parse",
+                  f"{address}",
+                  '--output=json'],
+                 stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                 text=True)
     try:
         check.check_returncode()
         return json.loads(check.stdout[:-1])
@@ -37,13 +63,13 @@ def get_balance(address: str, node: str, chain_id: str, binary: str):
     """
     gaiad query bank balances <address> <node> <chain-id>
     """
-    balance = subprocess.run([binary, "query", "bank", "balances",
-                              f"{address}",
-                              f"--node={node}",
-                              f"--chain-id={chain_id}",
-                              '--output=json'],
-                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                             text=True)
+    balance = _run([binary, "query", "bank", "balances",
+                    f"{address}",
+                    f"--node={node}",
+                    f"--chain-id={chain_id}",
+                    '--output=json'],
+                   stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                   text=True)
     try:
         balance.check_returncode()
         return json.loads(balance.stdout)['balances']
@@ -61,7 +87,7 @@ def get_node_status(node: str, binary: str):
     """
     gaiad status <node>
     """
-    status = subprocess.run(
+    status = _run(
         [binary, 'status', f'--node={node}'],
         stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
     try:
@@ -86,12 +112,12 @@ def get_tx_info(hash_id: str, node: str, chain_id: str, binary: str):
     """
     gaiad query tx <tx-hash> <node> <chain-id>
     """
-    query_response = subprocess.run([binary, 'query', 'tx',
-                              f'{hash_id}',
-                              f'--node={node}',
-                              f'--chain-id={chain_id}',
-                              '--output=json'],
-                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    query_response = _run([binary, 'query', 'tx',
+                           f'{hash_id}',
+                           f'--node={node}',
+                           f'--chain-id={chain_id}',
+                           '--output=json'],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
     try:
         query_response.check_returncode()
         query_response = json.loads(query_response.stdout)
@@ -135,23 +161,33 @@ def tx_send(request: dict):
     - "fees"
     - "node"
     - "chain_id"
+    and may include "gas" to override the default gas limit.
     gaiad tx bank send <from address> <to address> <amount>
                        <fees> <node> <chain-id>
                        --keyring-backend=test -y
 
     """
-    tx_response = subprocess.run([request["binary"], 'tx', 'bank', 'send',
-                              f'{request["sender"]}',
-                              f'{request["recipient"]}',
-                              f'{request["amount"]}',
-                              f'--home={request["home"]}',
-                              f'--fees={request["fees"]}',
-                              f'--node={request["node"]}',
-                              f'--chain-id={request["chain_id"]}',
-                              '--keyring-backend=test',
-                              '--output=json',
-                              '-y'],
-                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    return tx_send_with_code(request)[0]
+
+
+def tx_send_with_code(request: dict):
+    """
+    Same as tx_send, also returns the response code and log:
+    (transaction hash, 0, '') or (None, error code, log)
+    """
+    gas = [f'--gas={request["gas"]}'] if request.get('gas') else []
+    tx_response = _run([request["binary"], 'tx', 'bank', 'send',
+                        f'{request["sender"]}',
+                        f'{request["recipient"]}',
+                        f'{request["amount"]}',
+                        f'--home={request["home"]}',
+                        f'--fees={request["fees"]}',
+                        f'--node={request["node"]}',
+                        f'--chain-id={request["chain_id"]}',
+                        '--keyring-backend=test',
+                        '--output=json',
+                        '-y'] + gas,
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
     try:
         tx_response.check_returncode()
         response = json.loads(tx_response.stdout)
@@ -161,8 +197,8 @@ def tx_send(request: dict):
                 'Transaction failed with code %s: %s',
                 response['code'],
                 response['raw_log'])
-            return None
-        return response['txhash']
+            return None, int(response['code']), response.get('raw_log', '')
+        return response['txhash'], 0, ''
     except subprocess.CalledProcessError as cpe:
         output = str(tx_response.stderr).split('\n', maxsplit=1)
         logging.error("%s[%s]", cpe, output)
@@ -172,4 +208,108 @@ def tx_send(request: dict):
         logging.critical(
             'Could not read %s in tx response: %s', err, output)
         raise err
-    return None
+
+
+def simulate_send(request: dict):
+    """
+    gaiad tx bank send <from address> <to address> <amount>
+                       <node> <chain-id> --gas=auto --dry-run
+    Returns the estimated gas as an integer
+    """
+    simulation = _run([request["binary"], 'tx', 'bank', 'send',
+                       f'{request["sender"]}',
+                       f'{request["recipient"]}',
+                       f'{request["amount"]}',
+                       f'--home={request["home"]}',
+                       f'--node={request["node"]}',
+                       f'--chain-id={request["chain_id"]}',
+                       '--keyring-backend=test',
+                       '--gas=auto',
+                       '--gas-adjustment=1',
+                       '--dry-run'],
+                      stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        simulation.check_returncode()
+        # The estimate is printed to stderr or stdout depending on the SDK version
+        match = re.search(r'gas estimate: (\d+)', simulation.stderr + simulation.stdout)
+        if match is None:
+            raise ValueError(f'No gas estimate in output: {simulation.stderr}')
+        return int(match.group(1))
+    except subprocess.CalledProcessError as cpe:
+        output = str(simulation.stderr).split('\n', maxsplit=1)
+        logging.error("%s[%s]", cpe, output)
+        raise cpe
+
+
+def get_gas_price(denom: str, node: str, binary: str):
+    """
+    gaiad query feemarket gas-price <denom> <node>
+    Returns the current gas price as a float
+    Only available on chains running the feemarket module
+    """
+    price = _run([binary, 'query', 'feemarket', 'gas-price',
+                  f'{denom}',
+                  f'--node={node}',
+                  '--output=json'],
+                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        price.check_returncode()
+        return float(json.loads(price.stdout)['price']['amount'])
+    except subprocess.CalledProcessError as cpe:
+        output = str(price.stderr).split('\n', maxsplit=1)
+        logging.error("%s[%s]", cpe, output)
+        raise cpe
+
+
+def get_account(address: str, node: str, binary: str):
+    """
+    gaiad query auth account <address> <node>
+    Returns the account number and sequence as integers
+    """
+    account = _run([binary, 'query', 'auth', 'account',
+                    f'{address}',
+                    f'--node={node}',
+                    '--output=json'],
+                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        account.check_returncode()
+        account = json.loads(account.stdout)
+        # The account is nested differently depending on the SDK version
+        # and on the account type (e.g. vesting accounts)
+        for key in ('account', 'value', 'base_vesting_account', 'base_account'):
+            if 'account_number' in account.keys():
+                break
+            account = account.get(key, account)
+        if 'account_number' not in account.keys():
+            logging.critical('No account number for %s in: %s', address, account)
+            raise KeyError('account_number')
+        # A new account has no sequence yet
+        return int(account['account_number']), int(account.get('sequence', 0))
+    except subprocess.CalledProcessError as cpe:
+        output = str(account.stderr).split('\n', maxsplit=1)
+        logging.error("%s[%s]", cpe, output)
+        raise cpe
+    except (TypeError, AttributeError) as err:
+        logging.critical('Could not read account for %s: %s', address, err)
+        raise KeyError from err
+
+
+def export_private_key(key_name: str, home: str, binary: str):
+    """
+    gaiad keys export <key name> --unarmored-hex --unsafe
+                      --keyring-backend=test
+    Returns the private key as a hex string
+    """
+    export = _run([binary, 'keys', 'export', f'{key_name}',
+                   '--unarmored-hex', '--unsafe',
+                   f'--home={home}',
+                   '--keyring-backend=test'],
+                  input='y\n',
+                  stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        export.check_returncode()
+        return export.stdout.strip().split('\n')[-1]
+    except subprocess.CalledProcessError as cpe:
+        output = str(export.stderr).split('\n', maxsplit=1)
+        logging.error("%s[%s]", cpe, output)
+        raise cpe
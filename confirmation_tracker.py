@@ -0,0 +1,124 @@
+"""
+Tracks broadcast transactions until they are committed
+- pending hashes are checked in bulk once per new block
+- each block is read with a single tx_search query
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+from rpc_calls import RpcClient
+
+LOOKBACK_BLOCKS = 5  # Blocks re-read when tracking resumes after being idle
+SECONDS_PER_BLOCK = 10  # Upper bound on block time, expires hashes when no height can be read
+
+SENT = 'sent'  # Broadcast, outcome not known yet
+COMMITTED = 'committed'
+FAILED = 'failed'
+UNKNOWN = 'unknown'  # Not found in time, it may still be committed later
+
+
+class ConfirmationTracker():
+    """
+    Resolves pending transactions for one chain.
+    on_resolved(tx_hash, entry, status, height, log) is awaited once per hash.
+    """
+
+    def __init__(self, chain_id: str, rpc: RpcClient,
+                 on_resolved: Callable[..., Awaitable[None]],
+                 poll_interval: float = 2, max_blocks: int = 20):
+        self._chain_id = chain_id
+        self._rpc = rpc
+        self._on_resolved = on_resolved
+        self._poll_interval = poll_interval
+        self._max_blocks = max_blocks
+        self._pending = {}
+        self._scanned = None  # Last block height that was read
+        self._latest = None  # Last block height reported by the node
+        self._wakeup = asyncio.Event()
+
+    def track(self, tx_hash: str, entry: dict) -> None:
+        """
+        Start tracking a broadcast transaction
+        """
+        entry['since'] = None
+        entry['tracked_at'] = time.monotonic()
+        self._pending[tx_hash.upper()] = entry
+        self._wakeup.set()
+
+    def pending(self) -> int:
+        """
+        Number of transactions waiting for a block
+        """
+        return len(self._pending)
+
+    async def run(self) -> None:
+        """
+        Poll for new blocks while there are pending transactions
+        """
+        while True:
+            if not self._pending:
+                self._scanned = None
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            try:
+                await self.poll()
+            except (KeyError, ValueError, ConnectionError, TimeoutError) as ex:
+                logging.error('Confirmation poll failed for %s: %s', self._chain_id, ex)
+            except Exception as ex:  # pylint: disable=broad-except
+                # A single bad poll must not stop tracking for the chain
+                logging.exception('Unexpected error in confirmation poll for %s: %s',
+                                  self._chain_id, ex)
+            await asyncio.sleep(self._poll_interval)
+
+    async def poll(self) -> None:
+        """
+        Resolve the hashes found in new blocks, then expire the ones
+        that were not found in time, even if the blocks could not be read
+        """
+        try:
+            await self._scan()
+        finally:
+            await self._expire()
+
+    async def _scan(self) -> None:
+        """
+        Read every block since the last poll and resolve the hashes found in them
+        """
+        latest = self._latest = await self._rpc.latest_height()
+        if self._scanned is None:
+            self._scanned = latest - LOOKBACK_BLOCKS
+        # Hashes older than max_blocks expire anyway, no need to read further back
+        self._scanned = max(self._scanned, latest - self._max_blocks - LOOKBACK_BLOCKS)
+        for entry in self._pending.values():
+            if entry['since'] is None:
+                entry['since'] = latest
+
+        for height in range(self._scanned + 1, latest + 1):
+            txs = await self._rpc.tx_search(f'tx.height={height}')
+            self._scanned = height
+            for tx in txs:
+                entry = self._pending.pop(tx['hash'].upper(), None)
+                if entry is None:
+                    continue
+                code = int(tx['tx_result'].get('code', 0))
+                status = COMMITTED if code == 0 else FAILED
+                await self._on_resolved(tx['hash'].upper(), entry, status,
+                                        height, tx['tx_result'].get('log', ''))
+
+    async def _expire(self) -> None:
+        """
+        Give up on hashes not found within max_blocks.
+        Their outcome is unknown: the transaction may still be in the mempool.
+        """
+        now = time.monotonic()
+        for tx_hash, entry in list(self._pending.items()):
+            waited = self._latest - entry['since'] \
+                if entry['since'] is not None and self._latest is not None else 0
+            if waited > self._max_blocks or \
+                    now - entry['tracked_at'] > self._max_blocks * SECONDS_PER_BLOCK:
+                del self._pending[tx_hash]
+                await self._on_resolved(tx_hash, entry, UNKNOWN, None,
+                                        f'not found after {self._max_blocks} blocks')
@@ -4,16 +4,28 @@ Sets up a Discord bot to provide info and tokens
 """
 
 import asyncio
+import contextvars
 import time
 import datetime
 import logging
+import os
+import signal
 import sys
+import shutil
 import subprocess
-from tabulate import tabulate
 import aiofiles as aiof
 import toml
 import discord
 import binary_calls as binary_calls
+import tracing
+from shared_state import SharedState, DAILY_CAP, TIME_LIMIT
+from shard_workers import WorkerPool, Requester
+from rpc_calls import RpcClient
+from confirmation_tracker import ConfirmationTracker, COMMITTED, SENT, UNKNOWN
+from gas_estimator import GasEstimator, CODE_OUT_OF_GAS, RETRY_CODES
+from admission import AdmissionControl
+from profiler import LoopProfiler
+from reply_scheduler import ReplyScheduler, PRIORITY_REQUEST, PRIORITY_INFO, MESSAGE_LIMIT
 
 from typing import Optional, Tuple
 
@@ -23,7 +35,9 @@ disc_log.setLevel(logging.CRITICAL)
 
 # Configure Logging
 logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s %(levelname)s %(message)s')
+                    format='%(asctime)s %(levelname)s [%(request_id)s] %(message)s')
+for log_handler in logging.getLogger().handlers:
+    log_handler.addFilter(tracing.RequestIdFilter())
 
 # Global variables (will be initialized by load_config)
 config = None
@@ -34,22 +48,53 @@ LISTENING_CHANNELS = None
 chains = None
 ACTIVE_REQUESTS = None
 chain_locks = {}  # Locks for each chain to prevent race conditions
+CONFIG_PATH = 'config.toml'
+SHARED_STATE = None  # SQLite-backed state, only used when sharding
+WORKER_POOL = None  # Worker processes, only set in the supervisor
+SIGNERS = {}  # In-process signers for chains with signer = "native"
+TRACKERS = {}  # Confirmation trackers, only set when confirmations are enabled
+TRACKER_TASKS = {}  # Chain ID -> task running its tracker
+REPLY_HANDLE = contextvars.ContextVar('reply_handle', default=None)
+GAS_ESTIMATOR = GasEstimator()  # Only used by chains with fee_mode = "estimate"
+REPLY_SCHEDULER = None
+ADMISSION = None
+PROFILER = None  # Idle until a session is started by signal or $profile
+PROFILE_ADMINS = []  # Discord user IDs allowed to use $profile
+PROFILE_DURATION = 30  # Default seconds per profiling session
+PROFILE_MAX_DURATION = 300
+METRICS_PATH = None
+METRICS_PERIOD = 15  # Seconds between bot metrics updates
+BACKGROUND_STARTED = False
+DEGRADED = {}  # Chain ID -> reason the chain failed its preflight checks
+QUERY_CACHE = {}  # (chain ID, query) -> (expiry, result)
+QUERY_CACHE_TTL = 5  # Seconds a cached node query stays valid
+PREFLIGHT_CACHE_TTL = 120  # Seconds the queries made by the preflight checks stay valid
+PREFLIGHT_RETRY = 60  # Seconds between checks of degraded chains
 
 APPROVE_EMOJI = '✅'
 REJECT_EMOJI = '🚫'
+THROTTLE_EMOJI = '⏳'
 
 # Constants
 TX_HASH_LENGTH = 64  # Expected length of transaction hash ID
 TWO_HOURS_IN_MINUTES = 120  # Threshold for displaying hours vs minutes
+FAN_OUT_TIMEOUT = 10  # Seconds allowed for a query across several chains
+FAN_OUT_COMMANDS = {
+    # Command -> internal command that returns table rows for one chain
+    '$balance': '$balance_rows',
+    '$faucet_status': '$faucet_status_rows'
+}
 
 
 def load_config(config_path: str = 'config.toml') -> None:
     """
     Load configuration from TOML file and initialize global variables
     """
-    global config, TX_LOG_PATH, REQUEST_TIMEOUT
+    global config, TX_LOG_PATH, REQUEST_TIMEOUT, CONFIG_PATH, SHARED_STATE
+    global REPLY_SCHEDULER, METRICS_PATH, ADMISSION, PROFILER, PROFILE_ADMINS, PROFILE_DURATION
     global DISCORD_TOKEN, LISTENING_CHANNELS, chains, ACTIVE_REQUESTS
     
+    CONFIG_PATH = config_path
     try:
         config = toml.load(config_path)
     except FileNotFoundError:
@@ -65,17 +110,124 @@ def load_config(config_path: str = 'config.toml') -> None:
         DISCORD_TOKEN = str(config['discord']['bot_token'])
         LISTENING_CHANNELS = list(
             config['discord']['channels_to_listen'].split(','))
+        REPLY_SCHEDULER = ReplyScheduler(
+            merge=config['discord'].get('merge_replies', 'yes') == 'yes')
+        METRICS_PATH = config['discord'].get('metrics_file') or None
+        tracing.configure(config.get('tracing', {}).get('traces_file'),
+                          float(config.get('tracing', {}).get('sample_rate', 0)))
+        admission = config.get('admission', {})
+        ADMISSION = AdmissionControl(
+            user=(float(admission.get('user_per_minute', 6)), int(admission.get('user_burst', 3))),
+            channel=(float(admission.get('channel_per_minute', 60)), int(admission.get('channel_burst', 20))),
+            overall=(float(admission.get('global_per_minute', 300)), int(admission.get('global_burst', 60))))
+        profiling = config.get('profiling', {})
+        PROFILER = LoopProfiler(output_dir=profiling.get('output_dir', '.'),
+                                slow_callback=float(profiling.get('slow_callback', 0.1)))
+        PROFILE_ADMINS = [admin.strip() for admin in profiling.get('admins', '').split(',')
+                          if admin.strip()]
+        PROFILE_DURATION = int(profiling.get('duration', 30))
         chains = config['chains']
         for chain in chains:
             chains[chain]["active_day"] = datetime.datetime.today().date()
             chains[chain]["day_tally"] = 0
             chain_locks[chain] = asyncio.Lock()  # Create lock for each chain
         ACTIVE_REQUESTS = {chain: {} for chain in chains}
+        if int(config.get('sharding', {}).get('workers', 0)) > 0:
+            SHARED_STATE = SharedState(config['sharding']['state_db'])
     except KeyError as key:
         logging.critical('Key could not be found in config: %s', key)
         sys.exit(1)
 
 
+def initialize_signers(chain_ids: Optional[list] = None) -> None:
+    """
+    Load the faucet key for every chain configured with the native signer,
+    or only for chain_ids. Chains whose signer cannot be set up fall back to the binary.
+    """
+    for chain_id, chain in chains.items():
+        if chain.get('signer', 'binary') != 'native' or \
+                (chain_ids is not None and chain_id not in chain_ids):
+            continue
+        # Deferred so chains using the binary never load the signing libraries
+        from native_signer import NativeSigner  # pylint: disable=import-outside-toplevel
+        try:
+            SIGNERS[chain_id] = NativeSigner(chain)
+        except (KeyError, ValueError, TimeoutError, subprocess.CalledProcessError) as ex:
+            logging.error('Native signer unavailable for %s, using %s: %s',
+                          chain_id, chain['binary'], ex)
+
+
+def initialize_trackers(chain_ids: Optional[list] = None) -> None:
+    """
+    Start a confirmation tracker for every chain, or only for chain_ids.
+    Must be called from the running event loop.
+    """
+    confirmations = config.get('confirmations', {})
+    if TRACKERS or confirmations.get('enabled', 'no') != 'yes':
+        return
+    for chain_id, chain in chains.items():
+        if chain_ids is not None and chain_id not in chain_ids:
+            continue
+        TRACKERS[chain_id] = ConfirmationTracker(
+            chain_id=chain_id,
+            rpc=RpcClient(chain['node_url']),
+            on_resolved=_on_transfer_resolved,
+            poll_interval=float(confirmations.get('poll_interval', 2)),
+            max_blocks=int(confirmations.get('max_blocks', 20)))
+        _start_tracker(chain_id)
+
+
+def _start_tracker(chain_id: str) -> None:
+    """
+    Run a chain's tracker, restarting it if it stops
+    """
+    task = asyncio.get_running_loop().create_task(TRACKERS[chain_id].run())
+    TRACKER_TASKS[chain_id] = task
+    task.add_done_callback(lambda done: _on_tracker_done(chain_id, done))
+
+
+def _on_tracker_done(chain_id: str, task: asyncio.Task) -> None:
+    """
+    Log why a tracker stopped and start it again
+    """
+    if task.cancelled():
+        return
+    logging.error('Confirmation tracker for %s stopped: %r, restarting it',
+                  chain_id, task.exception())
+    _start_tracker(chain_id)
+
+
+class ReplyHandle():
+    """
+    Lets a background task update a reply after it has been sent
+    """
+
+    def __init__(self):
+        self.message = None
+        self.tracked = False
+        self._content = None
+
+    async def attach(self, message) -> None:
+        """
+        Set the sent reply, applying any update that arrived before it
+        """
+        self.message = message
+        if self._content is not None:
+            await self.edit(self._content)
+
+    async def edit(self, content: str) -> None:
+        """
+        Replace the content of the sent reply
+        """
+        if self.message is None:
+            self._content = content
+            return
+        try:
+            await self.message.edit(content=content)
+        except discord.HTTPException as ex:
+            logging.error('Could not update reply %s: %s', self.message.id, ex)
+
+
 HELP_MSG = None  # Will be set after config is loaded
 
 
@@ -95,6 +247,7 @@ def initialize_help_message() -> None:
         '`$faucet_status [chain ID]`\n\n' \
         '5. Query the faucet address: \n' \
         '`$faucet_address [chain ID]`\n\n' \
+        '`$balance` and `$faucet_status` also accept `all` or a comma-separated list of chain IDs.\n\n' \
         f'Example request: `$request {chains[list(chains.keys())[0]]["chain_id"]} cosmos1j7qzunvzx4cdqya80wvnrsmzyt9069d3gwhu5p`\n\n'
     
 
@@ -120,6 +273,128 @@ async def save_transaction_statistics(transaction: str) -> None:
         await csv_file.flush()
 
 
+async def write_metrics() -> None:
+    """
+    Periodically write the bot metrics to a Node Exporter file
+    """
+    prefix = 'faucet_reply_'
+    while True:
+        metrics = REPLY_SCHEDULER.metrics()
+        lines = [f'{prefix}queue_depth{{channel="{channel}"}} {depth}\n'
+                 for channel, depth in metrics.pop('queue_depth').items()]
+        lines.extend(f'{prefix}{name} {value}\n' for name, value in metrics.items())
+        for name, values in ADMISSION.metrics().items():
+            lines.extend(f'faucet_admission_{name}{{scope="{scope}"}} {value}\n'
+                         for scope, value in values.items())
+        # Node Exporter may read the file at any time, so it is replaced whole
+        partial_path = f'{METRICS_PATH}.tmp'
+        try:
+            async with aiof.open(partial_path, 'w') as metrics_file:
+                await metrics_file.writelines(lines)
+            os.replace(partial_path, METRICS_PATH)
+        except OSError as ex:
+            logging.error('Could not write metrics to %s: %s', METRICS_PATH, ex)
+        await asyncio.sleep(METRICS_PERIOD)
+
+
+def _cached_query(chain: dict, query: str, fetch, refresh: bool, ttl: float):
+    """
+    Returns the cached result of a node query, or fetches and caches it for ttl seconds
+    """
+    key = (chain['chain_id'], query)
+    cached = QUERY_CACHE.get(key)
+    if not refresh and cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    result = fetch()
+    QUERY_CACHE[key] = (time.monotonic() + ttl, result)
+    return result
+
+
+def get_node_status(chain: dict, refresh: bool = False, ttl: float = QUERY_CACHE_TTL) -> dict:
+    """
+    Returns the node status, cached for QUERY_CACHE_TTL seconds
+    """
+    return _cached_query(chain, 'node_status', lambda: binary_calls.get_node_status(
+        node=chain['node_url'], binary=chain['binary']), refresh, ttl)
+
+
+def get_faucet_balances(chain: dict, refresh: bool = False, ttl: float = QUERY_CACHE_TTL) -> list:
+    """
+    Returns the balances of the faucet address, cached for QUERY_CACHE_TTL seconds
+    """
+    return _cached_query(chain, 'faucet_balance', lambda: binary_calls.get_balance(
+        address=chain['faucet_address'],
+        node=chain['node_url'],
+        chain_id=chain['chain_id'],
+        binary=chain['binary']), refresh, ttl)
+
+
+def _preflight_chain(chain: dict) -> Optional[str]:
+    """
+    Check that the chain can serve requests and warm its gas estimate.
+    Returns None if the chain is ready, or the reason it is degraded.
+    Blocking, runs in a worker thread.
+    """
+    if shutil.which(chain['binary']) is None:
+        return f'{chain["binary"]} not found'
+    try:
+        # Cached long enough for the first status and transfer requests to use
+        if get_node_status(chain, refresh=True, ttl=PREFLIGHT_CACHE_TTL)['syncs']:
+            return 'node is catching up'
+        balances = get_faucet_balances(chain, refresh=True, ttl=PREFLIGHT_CACHE_TTL)
+        balance = next((int(coin['amount']) for coin in balances
+                        if coin['denom'] == chain['denom']), 0)
+        if balance < int(chain['amount_to_send']):
+            return f'faucet balance is {balance}{chain["denom"]}'
+        # Native signers read their account in _preflight instead
+        if chain['chain_id'] not in SIGNERS:
+            binary_calls.get_account(address=chain['faucet_address'],
+                                     node=chain['node_url'], binary=chain['binary'])
+        # Warms the gas estimate for chains with fee_mode = "estimate"
+        _build_transaction_request(chain, chain['faucet_address'])
+    except (KeyError, ValueError, TypeError, TimeoutError, subprocess.CalledProcessError) as ex:
+        return f'{chain["binary"]} could not query the node: {ex}'
+    return None
+
+
+async def _preflight(chain_id: str) -> Optional[str]:
+    """
+    Run the blocking checks for a chain, then resync its native signer
+    """
+    reason = await asyncio.to_thread(_preflight_chain, chains[chain_id])
+    signer = SIGNERS.get(chain_id)
+    if reason is None and signer is not None:
+        # Sends update the signer's sequence within the chain lock
+        async with chain_locks[chain_id]:
+            try:
+                await asyncio.to_thread(signer.sync_account)
+            except (KeyError, ValueError, TimeoutError, subprocess.CalledProcessError) as ex:
+                reason = f'{chains[chain_id]["binary"]} could not read the faucet account: {ex}'
+    return reason
+
+
+async def preflight_chains(chain_ids: list) -> None:
+    """
+    Check all the chains concurrently, then keep checking the degraded ones
+    """
+    while True:
+        results = await asyncio.gather(*(_preflight(chain_id) for chain_id in chain_ids),
+                                       return_exceptions=True)
+        for chain_id, reason in zip(chain_ids, results):
+            if isinstance(reason, Exception):
+                reason = f'preflight checks failed: {reason}'
+            if reason is None:
+                DEGRADED.pop(chain_id, None)
+                logging.info('Chain %s is ready', chain_id)
+            else:
+                DEGRADED[chain_id] = reason
+                logging.warning('Chain %s is degraded: %s', chain_id, reason)
+        chain_ids = list(DEGRADED.keys())
+        if not chain_ids:
+            return
+        await asyncio.sleep(PREFLIGHT_RETRY)
+
+
 async def get_faucet_balance(chain: dict) -> Optional[str]:
     """
     Returns the balance for the chain's denomination, or None if not found
@@ -127,11 +402,7 @@ async def get_faucet_balance(chain: dict) -> Optional[str]:
     # Use chain-specific denom if available, otherwise use uatom
     target_denom = chain.get('denom', 'uatom')
     
-    balances = binary_calls.get_balance(
-        address=chain['faucet_address'],
-        node=chain['node_url'],
-        chain_id=chain['chain_id'],
-        binary=chain['binary'])
+    balances = get_faucet_balances(chain)
     for balance in balances:
         if balance['denom'] == target_denom:
             return balance['amount'] + target_denom
@@ -144,7 +415,8 @@ async def balance_request(address: str, chain: dict) -> str:
     """
     try:
         # check address is valid
-        result = binary_calls.check_address(address, binary=chain['binary'])
+        with tracing.span('validate_address'):
+            result = binary_calls.check_address(address, binary=chain['binary'])
         if result['human'] == chain['prefix']:
             try:
                 balance = binary_calls.get_balance(
@@ -152,13 +424,14 @@ async def balance_request(address: str, chain: dict) -> str:
                     node=chain["node_url"],
                     chain_id=chain["chain_id"],
                     binary=chain["binary"])
+                from tabulate import tabulate  # pylint: disable=import-outside-toplevel
                 return f'Balance for address `{address}` in chain `{chain["chain_id"]}`:\n```\n{tabulate(balance)}\n```\n'
             except (KeyError, ValueError, ConnectionError, TimeoutError, subprocess.CalledProcessError) as ex:
                 logging.error('Balance request failed: %s', ex)
                 return f'❗ {chain["binary"]} could not handle your request'
         else:
             return f'❗ Expected `{chain["prefix"]}` prefix'
-    except (KeyError, ValueError, TypeError, subprocess.CalledProcessError) as ex:
+    except (KeyError, ValueError, TypeError, TimeoutError, subprocess.CalledProcessError) as ex:
         logging.error('Address verification failed: %s', ex)
         return f'❗ {chain["binary"]} could not verify the address'
 
@@ -169,7 +442,7 @@ async def faucet_status(chain: dict) -> str:
     """
     logging.info('Faucet status requested for %s', chain['chain_id'])
     try:
-        node_status = binary_calls.get_node_status(node=chain['node_url'], binary=chain['binary']) 
+        node_status = get_node_status(chain)
         if node_status.keys():
             return f'```\n' \
                 f'Node moniker:       {node_status["moniker"]}\n' \
@@ -210,6 +483,83 @@ async def transaction_info(hash_id: str, chain: dict) -> str:
         return f'❗ Hash ID must be {TX_HASH_LENGTH} characters long, received `{len(hash_id)}`'
 
 
+def _balance_rows(address: str, chain: dict) -> list:
+    """
+    Balance table rows for one chain: chain ID, amount, denom
+    Blocking, runs in a worker thread.
+    """
+    try:
+        result = binary_calls.check_address(address, binary=chain['binary'])
+        if result['human'] != chain['prefix']:
+            return [[chain['chain_id'], f'expected {chain["prefix"]} prefix', '']]
+        balances = binary_calls.get_balance(
+            address=address,
+            node=chain['node_url'],
+            chain_id=chain['chain_id'],
+            binary=chain['binary'])
+        return [[chain['chain_id'], coin['amount'], coin['denom']] for coin in balances] or \
+            [[chain['chain_id'], '0', chain['denom']]]
+    except (KeyError, ValueError, TypeError, ConnectionError, TimeoutError, subprocess.CalledProcessError) as ex:
+        logging.error('Balance request failed in %s: %s', chain['chain_id'], ex)
+        return [[chain['chain_id'], f'{chain["binary"]} could not handle the request', '']]
+
+
+def _faucet_status_rows(chain: dict) -> list:
+    """
+    Status table row for one chain: chain ID, moniker, last block, amount per request
+    Blocking, runs in a worker thread.
+    """
+    try:
+        node_status = get_node_status(chain)
+        return [[chain['chain_id'], node_status['moniker'], node_status['last_block'],
+                 chain['amount_to_send'] + chain['denom']]]
+    except (KeyError, ValueError, ConnectionError, TimeoutError, subprocess.CalledProcessError) as ex:
+        logging.error('Faucet status request failed in %s: %s', chain['chain_id'], ex)
+        return [[chain['chain_id'], f'{chain["binary"]} could not handle the request', '', '']]
+
+
+async def fan_out_request(command: str, chain_ids: list, message_sections: list, channel: str) -> str:
+    """
+    Run a query on several chains concurrently and combine the results in one table.
+    Chains that do not answer within FAN_OUT_TIMEOUT are marked as timed out.
+    """
+    async def query(chain_id: str) -> list:
+        if WORKER_POOL is not None:
+            return await WORKER_POOL.submit(chain_id, channel, FAN_OUT_COMMANDS[command],
+                                            message_sections, None)
+        return await dispatch_command(FAN_OUT_COMMANDS[command], chains[chain_id],
+                                      message_sections, None)
+
+    tasks = {chain_id: asyncio.create_task(query(chain_id)) for chain_id in chain_ids}
+    _, pending = await asyncio.wait(tasks.values(), timeout=FAN_OUT_TIMEOUT)
+    for task in pending:
+        task.cancel()
+
+    if command == '$balance':
+        headers = ['Chain', 'Amount', 'Denom']
+        title = f'Balance for address `{message_sections[2]}`:'
+    else:
+        headers = ['Chain', 'Node moniker', 'Last block', 'Amount per request']
+        title = 'Faucet status:'
+    rows = []
+    for chain_id, task in tasks.items():
+        if task in pending:
+            rows.append([chain_id, 'timed out'] + [''] * (len(headers) - 2))
+            continue
+        result = task.exception() or task.result()
+        if isinstance(result, list):
+            rows.extend(result)
+        else:
+            # A failed worker answers with an error string, a failed query raises
+            logging.error('%s failed in %s: %s', command, chain_id, result)
+            rows.append([chain_id, 'could not handle the request'] + [''] * (len(headers) - 2))
+    from tabulate import tabulate  # pylint: disable=import-outside-toplevel
+    table = tabulate(rows, headers=headers)
+    if len(table) > MESSAGE_LIMIT - len(title) - 10:
+        table = table[:MESSAGE_LIMIT - len(title) - 11] + '…'
+    return f'{title}\n```\n{table}\n```'
+
+
 def format_timeout_message(check_time: float, message_timestamp: float) -> str:
     """
     Generate a timeout message based on the time remaining
@@ -315,7 +665,7 @@ def _build_transaction_request(chain: dict, address: str) -> dict:
     """
     Build the transaction request dictionary
     """
-    return {
+    request = {
         'binary': chain['binary'],
         'sender': chain['faucet_address'],
         'recipient': address,
@@ -325,6 +675,26 @@ def _build_transaction_request(chain: dict, address: str) -> dict:
         'node': chain['node_url'],
         'home': chain['home_folder']
     }
+    if chain.get('fee_mode', 'static') == 'estimate':
+        try:
+            request['gas'] = GAS_ESTIMATOR.gas_limit(chain, request)
+            request['fees'] = GAS_ESTIMATOR.fees(chain, request['gas'])
+        except (KeyError, ValueError, TimeoutError, subprocess.CalledProcessError) as ex:
+            logging.error('Gas estimation failed for %s, using tx_fees: %s',
+                          chain['chain_id'], ex)
+            request.pop('gas', None)
+    return request
+
+
+async def _send_transfer(chain: dict, request: dict) -> Tuple[Optional[str], int, str]:
+    """
+    Sign in-process when a native signer is set up, otherwise call the binary
+    Returns (transaction hash, 0, '') or (None, error code, log)
+    """
+    signer = SIGNERS.get(chain['chain_id'])
+    if signer is not None:
+        return await signer.tx_send_with_code(request)
+    return binary_calls.tx_send_with_code(request)
 
 
 async def _execute_token_transfer(requester, address: str, chain: dict, delta: int) -> str:
@@ -334,27 +704,121 @@ async def _execute_token_transfer(requester, address: str, chain: dict, delta: i
     """
     request = _build_transaction_request(chain, address)
     
-    # Make binary call and send the response back
-    transfer = binary_calls.tx_send(request)
+    transfer, code, log = await _send_transfer(chain, request)
+    if transfer is None and code in RETRY_CODES and 'gas' in request:
+        if code == CODE_OUT_OF_GAS:
+            # Gas usage changed, simulate again
+            logging.info('Refreshing gas estimate for %s after code %s', chain['chain_id'], code)
+            GAS_ESTIMATOR.invalidate(chain['chain_id'])
+            request = _build_transaction_request(chain, address)
+        else:
+            # The minimum gas price went up, pay what the node asks for
+            request['fees'] = GAS_ESTIMATOR.raise_fees(chain, request['gas'], log)
+            logging.info('Raising fees for %s to %s after code %s',
+                         chain['chain_id'], request['fees'], code)
+        transfer, code, _ = await _send_transfer(chain, request)
     if transfer is None:
         raise RuntimeError('Transaction failed')
+    # The cached balance no longer includes this send
+    QUERY_CACHE.pop((chain['chain_id'], 'faucet_balance'), None)
     logging.info('%s requested tokens for %s in %s',
                  requester, address, chain['chain_id'])
-    now = datetime.datetime.now()
 
-    # Get faucet balance and save to transaction log
-    balance = await get_faucet_balance(chain)
-    await save_transaction_statistics(f'{now.isoformat(timespec="seconds")},'
-                                      f'{chain["chain_id"]},{address},'
-                                      f'{chain["amount_to_send"] + chain["denom"]},'
-                                      f'{transfer},'
-                                      f'{balance}')
-    
     # Format reply with block explorer link or hash
     if chain["block_explorer_tx"]:
-        return f'✅  <{chain["block_explorer_tx"]}{transfer}>'
+        reply = f'✅  <{chain["block_explorer_tx"]}{transfer}>'
     else:
-        return f'✅ Hash ID: {transfer}'
+        reply = f'✅ Hash ID: {transfer}'
+
+    tracker = TRACKERS.get(chain['chain_id'])
+    if tracker is not None:
+        # Logged as sent now, the outcome gets its own row once it is known
+        await _log_transfer(chain, address, transfer, SENT)
+        handle = REPLY_HANDLE.get()
+        if handle is not None:
+            handle.tracked = True
+        tracker.track(transfer, {'chain_id': chain['chain_id'], 'requester_id': requester.id,
+                                 'address': address, 'delta': delta,
+                                 'reply': reply, 'handle': handle,
+                                 'trace_context': tracing.current_context()})
+        return reply
+
+    await _log_transfer(chain, address, transfer)
+    return reply
+
+
+async def _log_transfer(chain: dict, address: str, transfer: str, status: Optional[str] = None) -> None:
+    """
+    Get the faucet balance and save the transfer to the transaction log
+    """
+    now = datetime.datetime.now()
+    with tracing.span('balance_refresh'):
+        balance = await get_faucet_balance(chain)
+    with tracing.span('log_write'):
+        await save_transaction_statistics(f'{now.isoformat(timespec="seconds")},'
+                                          f'{chain["chain_id"]},{address},'
+                                          f'{chain["amount_to_send"] + chain["denom"]},'
+                                          f'{transfer},'
+                                          f'{balance}' +
+                                          (f',{status}' if status else ''))
+
+
+async def _on_transfer_resolved(tx_hash: str, entry: dict, status: str,
+                                height: Optional[int], log: str) -> None:
+    """
+    Called by the confirmation tracker once a transfer is committed or has failed
+    """
+    # A fresh context keeps the request's ID and trace off the tracker's later log lines
+    await asyncio.get_running_loop().create_task(
+        _resume_transfer_outcome(tx_hash, entry, status, height, log),
+        context=contextvars.Context())
+
+
+async def _resume_transfer_outcome(tx_hash: str, entry: dict, status: str,
+                                   height: Optional[int], log: str) -> None:
+    """
+    Apply the outcome as part of the request that sent the transaction,
+    so its log lines and spans are correlated with it
+    """
+    trace = tracing.resume_request(entry['trace_context'], 'transfer_outcome')
+    try:
+        await _apply_transfer_outcome(tx_hash, entry, status, height, log)
+    finally:
+        tracing.finish_request(trace)
+
+
+async def _apply_transfer_outcome(tx_hash: str, entry: dict, status: str,
+                                  height: Optional[int], log: str) -> None:
+    """
+    Update the state, transaction log and reply for a resolved transfer
+    """
+    chain = chains[entry['chain_id']]
+    if status == COMMITTED:
+        logging.info('Transaction %s committed in %s at height %s',
+                     tx_hash, chain['chain_id'], height)
+        content = f'{entry["reply"]}\n{APPROVE_EMOJI} Confirmed in block {height}'
+        QUERY_CACHE.pop((chain['chain_id'], 'faucet_balance'), None)
+    elif status == UNKNOWN:
+        # It may still be committed, so the time limits and tally are kept
+        logging.warning('Transaction %s in %s was not confirmed: %s',
+                        tx_hash, chain['chain_id'], log)
+        content = f'{entry["reply"]}\n⚠️ Not confirmed yet ({log}), check the explorer before requesting again'
+    else:
+        logging.error('Transaction %s failed in %s: %s', tx_hash, chain['chain_id'], log)
+        # Roll back the state changes so the user can request again
+        async with chain_locks[chain['chain_id']]:
+            _release_request(entry['requester_id'], entry['address'], chain, entry['delta'])
+        # The send may have run out of gas, estimate again for the next one
+        GAS_ESTIMATOR.invalidate(chain['chain_id'])
+        content = f'❗ Transaction `{tx_hash}` was not committed: {log[:200]}'
+
+    try:
+        await _log_transfer(chain, entry['address'], tx_hash, status)
+    except (KeyError, ValueError, ConnectionError, TimeoutError, subprocess.CalledProcessError) as ex:
+        logging.error('Could not log transaction %s: %s', tx_hash, ex)
+    if entry['handle'] is not None:
+        await entry['handle'].edit(content)
+
 
 async def token_request(requester, address: str, chain: dict) -> str:
     """
@@ -363,55 +827,146 @@ async def token_request(requester, address: str, chain: dict) -> str:
     # Check address
     try:
         # check address is valid
-        result = binary_calls.check_address(address, chain['binary'])
+        with tracing.span('validate_address'):
+            result = binary_calls.check_address(address, chain['binary'])
         if result['human'] != chain['prefix']:
             return f'❗ Expected `{chain["prefix"]}` prefix'
-    except (KeyError, ValueError, TypeError, subprocess.CalledProcessError) as ex:
+    except (KeyError, ValueError, TypeError, TimeoutError, subprocess.CalledProcessError) as ex:
         logging.error('Address verification failed for %s: %s', address, ex)
         return f'❗ {chain["binary"]} could not verify the address'
 
     delta = int(chain["amount_to_send"])
     
     # Use lock to prevent race conditions on shared state
-    async with chain_locks[chain['chain_id']]:
-        # Check whether the faucet has reached the daily cap
-        if not check_daily_cap(chain=chain, delta=delta):
-            logging.info('%s requested tokens for %s in %s '
-                         'but the daily cap has been reached',
-                         requester, address, chain['chain_id'])
-            return 'Sorry, the daily cap for this faucet has been reached'
-        
-        # Check whether user or address have received tokens on this chain
-        approved, reply = check_time_limits(
-            requester=requester.id, address=address, chain=chain)
-        
-        if not approved:
-            logging.info('%s requested tokens for %s in %s and was rejected',
-                         requester, address, chain['chain_id'])
+    with tracing.span('chain_lock'):
+        await chain_locks[chain['chain_id']].acquire()
+    try:
+        reply = _reserve_request(requester, address, chain, delta)
+        if reply is not None:
             return reply
         
-        # Increment the daily tally now that we're committed to the request
-        increment_daily_tally(chain, delta)
-        
         try:
             reply = await _execute_token_transfer(requester, address, chain, delta)
         except (KeyError, ValueError, ConnectionError, TimeoutError, RuntimeError, subprocess.CalledProcessError) as ex:
             # Rollback state changes on failure
-            del ACTIVE_REQUESTS[chain['chain_id']][requester.id]
-            del ACTIVE_REQUESTS[chain['chain_id']][address]
-            chain['day_tally'] -= delta
+            _release_request(requester.id, address, chain, delta)
             logging.error('Token transfer failed for %s to %s in %s: %s', requester, address, chain['chain_id'], ex)
             reply = '❗ request could not be processed'
+    finally:
+        chain_locks[chain['chain_id']].release()
     
     return reply
 
 
+def _reserve_request(requester, address: str, chain: dict, delta: int) -> Optional[str]:
+    """
+    Check the daily cap and time limits and register the request.
+    Returns None if the request may proceed, or the rejection reply.
+    Should only be called within the chain lock
+    """
+    if SHARED_STATE is not None:
+        status, check_time = SHARED_STATE.reserve(
+            chain['chain_id'], requester.id, address, delta,
+            daily_cap=int(chain['daily_cap']), timeout=REQUEST_TIMEOUT)
+        cap_reached = status == DAILY_CAP
+        reply = format_timeout_message(check_time, time.time()) if status == TIME_LIMIT else None
+    else:
+        # Check whether the faucet has reached the daily cap
+        cap_reached = not check_daily_cap(chain=chain, delta=delta)
+        reply = None
+        if not cap_reached:
+            # Check whether user or address have received tokens on this chain
+            _, reply = check_time_limits(
+                requester=requester.id, address=address, chain=chain)
+            if reply is None:
+                # Increment the daily tally now that we're committed to the request
+                increment_daily_tally(chain, delta)
+
+    if cap_reached:
+        logging.info('%s requested tokens for %s in %s '
+                     'but the daily cap has been reached',
+                     requester, address, chain['chain_id'])
+        return 'Sorry, the daily cap for this faucet has been reached'
+
+    if reply is not None:
+        logging.info('%s requested tokens for %s in %s and was rejected',
+                     requester, address, chain['chain_id'])
+    return reply
+
+
+def _release_request(requester_id, address: str, chain: dict, delta: int) -> None:
+    """
+    Roll back the time limits and daily tally registered for a request
+    """
+    if SHARED_STATE is not None:
+        SHARED_STATE.release(chain['chain_id'], requester_id, address, delta)
+        return
+    ACTIVE_REQUESTS[chain['chain_id']].pop(requester_id, None)
+    ACTIVE_REQUESTS[chain['chain_id']].pop(address, None)
+    chain['day_tally'] -= delta
+
+
 @client.event
 async def on_ready() -> None:
     """
     Gets called when the Discord client logs in
     """
+    global BACKGROUND_STARTED
     logging.info('Logged into Discord as %s', client.user)
+    # on_ready is called again after reconnecting
+    if BACKGROUND_STARTED:
+        return
+    loop = asyncio.get_running_loop()
+    if WORKER_POOL is not None:
+        WORKER_POOL.watch()
+    else:
+        initialize_trackers()
+        loop.create_task(preflight_chains(list(chains.keys())))
+    if METRICS_PATH is not None:
+        loop.create_task(write_metrics())
+    BACKGROUND_STARTED = True
+
+
+@client.event
+async def setup_hook() -> None:
+    """
+    Gets called once before the Discord client connects
+    """
+    install_profiler_signal()
+
+
+def install_profiler_signal() -> None:
+    """
+    Start a profiling session in this process on SIGUSR1.
+    Before the event loop runs, the signal is only logged
+    so that it does not terminate the process.
+    """
+    if not hasattr(signal, 'SIGUSR1'):
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        signal.signal(signal.SIGUSR1,
+                      lambda *_: logging.warning('SIGUSR1 ignored, the event loop is not running yet'))
+        return
+    loop.add_signal_handler(signal.SIGUSR1, PROFILER.start, PROFILE_DURATION)
+
+
+def profile_request(message_sections: list) -> str:
+    """
+    Start a profiling session in the supervisor process
+    """
+    duration = PROFILE_DURATION
+    if len(message_sections) > 1:
+        try:
+            duration = min(max(int(message_sections[1]), 1), PROFILE_MAX_DURATION)
+        except ValueError:
+            return '❗ Usage: `$profile [seconds]`'
+    paths = PROFILER.start(duration)
+    if paths is None:
+        return '❗ A profiling session is already running'
+    return f'Profiling for {duration} seconds, results will be written to ' \
+        f'`{paths[0]}` and `{paths[1]}`'
 
 
 @client.event
@@ -419,6 +974,28 @@ async def on_message(message) -> None:
     """
     Responds to messages on specified channels.
     """
+    trace = tracing.start_request(None)
+    try:
+        await handle_message(message)
+    finally:
+        tracing.finish_request(trace)
+
+
+def _admission_cost(message_sections: list) -> int:
+    """
+    Tokens charged for a command: one per chain it queries
+    """
+    if message_sections[0] not in FAN_OUT_COMMANDS or len(message_sections) < 2:
+        return 1
+    if message_sections[1] == 'all':
+        return len(chains)
+    return max(1, len([name for name in message_sections[1].split(',') if name in chains]))
+
+
+async def handle_message(message) -> None:
+    """
+    Parses a message and replies to the command in it
+    """
     # Ignore messages from the bot itself
     if message.author == client.user:
         return
@@ -431,7 +1008,31 @@ async def on_message(message) -> None:
     if not message.content or not isinstance(message.content, str):
         return
 
-    message_sections = message.content.split(' ')    
+    with tracing.span('parse'):
+        message_sections = message.content.split(' ')
+        if message_sections[0] in COMMAND_LIST or message.content.startswith('$help'):
+            tracing.rename(message_sections[0])
+
+    # Admin-only and not listed in $help, so it is not subject to admission control
+    if message_sections[0] == '$profile':
+        if str(message.author.id) in PROFILE_ADMINS:
+            await REPLY_SCHEDULER.reply(message, profile_request(message_sections))
+        return
+
+    # Shed load before any reply or binary call is made for the command
+    if message_sections[0] in COMMAND_LIST or message.content.startswith('$help'):
+        scope = ADMISSION.admit(message.author.id, message.channel.id,
+                                cost=_admission_cost(message_sections))
+        if scope is not None:
+            logging.info('%s was throttled by the %s limit', message.author, scope)
+            # Under a global flood even reactions are skipped
+            if scope != 'global':
+                try:
+                    await message.add_reaction(THROTTLE_EMOJI)
+                except discord.HTTPException as ex:
+                    logging.error('Could not react to throttled message: %s', ex)
+            return
+
     if message.content.startswith('$help'):
         help_reply = HELP_MSG
         help_reply += '**Supported chain IDs**\n'
@@ -439,7 +1040,7 @@ async def on_message(message) -> None:
             help_reply += f'* `{chain}`\n'
             help_reply += f'  * {data["description"]}\n' if data['description'] else ''
             help_reply += f'  * {data["website"]}\n' if data['website'] else ''
-        await message.reply(help_reply)
+        await REPLY_SCHEDULER.reply(message, help_reply)
         return
 
     if len(message_sections) < 2:
@@ -448,33 +1049,79 @@ async def on_message(message) -> None:
     command = message_sections[0]
     if command in COMMAND_LIST:
         chain_id = message_sections[1]
-        if chain_id in chains.keys():
-            chain = chains[chain_id]
-            if command == '$faucet_address' and len(message_sections) == 2:
-                await message.reply(f'The `{chain_id}` faucet has address `{chain["faucet_address"]}`')
-            elif command == '$faucet_status' and len(message_sections) == 2:
-                await message.reply(await faucet_status(chain))
-            elif command == '$tx_info' and len(message_sections) == 3:
-                tx_hash = message_sections[2]
-                await message.reply(await transaction_info(tx_hash, chain))
-            elif command == '$balance' and len(message_sections) == 3:
-                address = message_sections[2]
-                await message.reply(await balance_request(address, chain))
-            elif command == '$request' and len(message_sections) == 3:
-                requester = message.author
-                address = message_sections[2]
-                await message.reply(await token_request(requester, address, chain))
+        if command in FAN_OUT_COMMANDS and (chain_id == 'all' or ',' in chain_id):
+            chain_ids = list(chains.keys()) if chain_id == 'all' else \
+                [name for name in chain_id.split(',') if name in chains.keys()]
+            if chain_ids and len(message_sections) == (3 if command == '$balance' else 2):
+                reply = await fan_out_request(command, chain_ids, message_sections,
+                                              message.channel.name)
+                await REPLY_SCHEDULER.reply(message, reply)
+        elif chain_id in chains.keys():
+            handle = ReplyHandle()
+            if WORKER_POOL is not None:
+                requester = Requester(message.author.id, str(message.author))
+                reply = await WORKER_POOL.submit(chain_id, message.channel.name,
+                                                 command, message_sections, requester, handle)
+            else:
+                REPLY_HANDLE.set(handle)
+                reply = await dispatch_command(command, chains[chain_id],
+                                               message_sections, message.author)
+            if reply is not None:
+                priority = PRIORITY_REQUEST if command == '$request' else PRIORITY_INFO
+                await handle.attach(await REPLY_SCHEDULER.reply(message, reply, priority))
     else:
         logging.info('command not recognized: %s', command)
 
 
+async def dispatch_command(command: str, chain: dict, message_sections: list, requester) -> Optional[str]:
+    """
+    Run a chain command and return the reply,
+    or None if the command has the wrong number of arguments.
+    The internal fan-out commands return table rows instead of a reply.
+    """
+    if command == '$faucet_address' and len(message_sections) == 2:
+        return f'The `{chain["chain_id"]}` faucet has address `{chain["faucet_address"]}`'
+    if command == '$faucet_status' and len(message_sections) == 2:
+        return await faucet_status(chain)
+    if command == '$tx_info' and len(message_sections) == 3:
+        return await transaction_info(message_sections[2], chain)
+    if command == '$balance' and len(message_sections) == 3:
+        return await balance_request(message_sections[2], chain)
+    if command == '$balance_rows' and len(message_sections) == 3:
+        return await asyncio.to_thread(_balance_rows, message_sections[2], chain)
+    if command == '$faucet_status_rows' and len(message_sections) == 2:
+        return await asyncio.to_thread(_faucet_status_rows, chain)
+    if command == '$request' and len(message_sections) == 3:
+        if chain['chain_id'] in DEGRADED:
+            return f'❗ `{chain["chain_id"]}` is unavailable: {DEGRADED[chain["chain_id"]]}'
+        return await token_request(requester, message_sections[2], chain)
+    return None
+
+
 def main() -> None:
     """
     Main entry point for the Discord bot
     """
+    global WORKER_POOL
+    install_profiler_signal()
     load_config()
     initialize_help_message()
-    client.run(DISCORD_TOKEN)
+    sharding = config.get('sharding', {})
+    workers = int(sharding.get('workers', 0))
+    if workers > 0:
+        WORKER_POOL = WorkerPool(config_path=CONFIG_PATH,
+                                 workers=workers,
+                                 shard_by=sharding.get('shard_by', 'chain'),
+                                 chain_ids=list(chains.keys()),
+                                 channels=LISTENING_CHANNELS)
+        WORKER_POOL.start()
+    else:
+        initialize_signers()
+    try:
+        client.run(DISCORD_TOKEN)
+    finally:
+        if WORKER_POOL is not None:
+            WORKER_POOL.stop()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+Summarizes the request traces written by the faucet bot.
+Usage:
+python cosmos_trace_summary.py [traces file] [number of slowest traces]
+Example:
+python cosmos_trace_summary.py traces.jsonl 10
+Outputs:
+- The slowest requests, with the span that took the longest in each.
+- Time spent per stage across all requests.
+"""
+
+import json
+import logging
+import sys
+
+from tabulate import tabulate
+
+
+def read_traces(filename: str) -> dict:
+    """
+    Returns the traces keyed by request ID.
+    Parts of a request written by different processes are merged.
+    """
+    requests = {}
+    with open(filename, 'r', encoding='utf-8') as traces_file:
+        for line_number, line in enumerate(traces_file, start=1):
+            try:
+                part = json.loads(line)
+            except json.JSONDecodeError as ex:
+                logging.error('Skipping line %s: %s', line_number, ex)
+                continue
+            request = requests.setdefault(part['request_id'], {
+                'name': part['name'], 'duration_ms': 0, 'spans': []})
+            request['duration_ms'] = max(request['duration_ms'], part['duration_ms'])
+            request['spans'].extend(part['spans'])
+    return requests
+
+
+def slowest_requests(requests: dict, count: int) -> list:
+    """
+    Rows for the slowest requests: request ID, command, duration, slowest span
+    """
+    rows = []
+    for request_id, request in sorted(requests.items(),
+                                      key=lambda item: item[1]['duration_ms'],
+                                      reverse=True)[:count]:
+        slowest = max(request['spans'], key=lambda span: span['duration_ms'], default=None)
+        rows.append([request_id, request['name'], request['duration_ms'],
+                     f'{slowest["name"]} ({slowest["duration_ms"]} ms)' if slowest else ''])
+    return rows
+
+
+def stage_breakdown(requests: dict) -> list:
+    """
+    Rows per stage: name, count, total, mean, 95th percentile, max and share of request time
+    """
+    stages = {}
+    for request in requests.values():
+        for span in request['spans']:
+            stages.setdefault(span['name'], []).append(span['duration_ms'])
+    request_time = sum(request['duration_ms'] for request in requests.values()) or 1
+    rows = []
+    for name, durations in stages.items():
+        durations.sort()
+        total = sum(durations)
+        rows.append([name, len(durations), round(total, 1),
+                     round(total / len(durations), 1),
+                     durations[int(0.95 * (len(durations) - 1))],
+                     durations[-1],
+                     f'{100 * total / request_time:.1f}%'])
+    return sorted(rows, key=lambda row: row[2], reverse=True)
+
+
+if __name__ == '__main__':
+    # Configure Logging
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+
+    if len(sys.argv) < 2:
+        logging.critical('Usage: python cosmos_trace_summary.py [traces file] [count]')
+        sys.exit(1)
+    traces = read_traces(sys.argv[1])
+    top = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    print(f'Slowest requests ({len(traces)} traced)')
+    print(tabulate(slowest_requests(traces, top),
+                   headers=['Request ID', 'Command', 'Duration (ms)', 'Slowest span']))
+    print()
+    print('Time per stage')
+    print(tabulate(stage_breakdown(traces),
+                   headers=['Stage', 'Count', 'Total (ms)', 'Mean (ms)',
+                            'p95 (ms)', 'Max (ms)', 'Share']))
@@ -2,9 +2,13 @@
 """
 Parses transaction log from faucet bot.
 The reader expects the following CSV format:
-ISO Date/Time,chain,address,amount sent,hash ID,faucet balance
+ISO Date/Time,chain,address,amount sent,hash ID,faucet balance[,status]
 For example:
 2022-01-01T10:10:10,theta,cosmos123...xyz,10000uatom,12AB...90YZ,5000000uatom
+2022-01-01T10:10:20,theta,cosmos123...xyz,10000uatom,34CD...12AB,4990000uatom,committed
+The status column is only written when transaction confirmations are enabled:
+a sent row is written at broadcast and a second row once the outcome is known.
+Only the latest row for each hash is used, and failed transactions are left out of the stats.
 """
 
 import csv
@@ -123,7 +127,7 @@ class TransactionReader():
             chain_mask = (self._data[:, 1] == chain)
             chain_masked_array = self._data[chain_mask, :]
             self._stats[chain]['tokens_balance_uatom'] = \
-                int(chain_masked_array[-1][-1].replace('uatom', ''))
+                int(chain_masked_array[-1][5].replace('uatom', ''))
 
     def process_stats(self):
         """
@@ -145,4 +149,11 @@ class TransactionReader():
         self._txs = []
         with open(self._filename, 'r', newline='', encoding='utf-8') as csvfile:
             data = list(csv.reader(csvfile, delimiter=','))
-        self._data = np.array(data)
+        # Older rows have no status column
+        data = [row[:6] + [row[6] if len(row) > 6 else 'sent'] for row in data]
+        # Keep the latest row for each hash, in the order the latest rows were written
+        latest = {}
+        for row in data:
+            latest.pop(row[4], None)
+            latest[row[4]] = row
+        self._data = np.array([row for row in latest.values() if row[6] != 'failed'])
@@ -0,0 +1,115 @@
+"""
+Gas estimation for faucet transfers
+- the gas used by a send is simulated once and cached per chain and message shape
+- fees are computed from the gas price observed on the chain,
+  or from the configured gas price when the chain does not report one
+- a send rejected for its fees raises the cached gas price to what the node asked for
+"""
+
+import logging
+import math
+import re
+import subprocess
+import time
+from typing import Optional
+
+import binary_calls
+
+DEFAULT_TTL = 600  # Seconds before a cached estimate is simulated again
+DEFAULT_GAS_ADJUSTMENT = 1.3
+FEE_RETRY_FACTOR = 1.5  # Gas price increase when a rejection does not state the required fee
+CODE_INSUFFICIENT_FEE = 13  # ErrInsufficientFee in the SDK
+CODE_OUT_OF_GAS = 11  # ErrOutOfGas in the SDK
+RETRY_CODES = (CODE_OUT_OF_GAS, CODE_INSUFFICIENT_FEE)
+REQUIRED_FEE = re.compile(r'required: ([^\s:;]+)')
+
+
+class GasEstimator():
+    """
+    Caches gas estimates and gas prices with a time to live
+    """
+
+    def __init__(self):
+        self._estimates = {}  # (chain ID, message shape) -> (gas, expiry)
+        self._prices = {}  # chain ID -> (gas price, expiry)
+
+    def invalidate(self, chain_id: str) -> None:
+        """
+        Drop every cached value for a chain
+        """
+        self._estimates = {key: value for key, value in self._estimates.items()
+                           if key[0] != chain_id}
+        self._prices.pop(chain_id, None)
+
+    def gas_limit(self, chain: dict, request: dict) -> int:
+        """
+        Returns the adjusted gas limit for a send request
+        """
+        # All faucet sends are a MsgSend with a single coin
+        key = (chain['chain_id'], 'MsgSend', chain['denom'])
+        cached = self._estimates.get(key)
+        if cached is not None and cached[1] > time.time():
+            return cached[0]
+        gas = math.ceil(binary_calls.simulate_send(request) *
+                        float(chain.get('gas_adjustment', DEFAULT_GAS_ADJUSTMENT)))
+        self._estimates[key] = (gas, time.time() + _ttl(chain))
+        logging.info('Gas estimate for %s: %s', chain['chain_id'], gas)
+        return gas
+
+    def gas_price(self, chain: dict) -> float:
+        """
+        Returns the gas price observed on the chain, or the configured one
+        """
+        cached = self._prices.get(chain['chain_id'])
+        if cached is not None and cached[1] > time.time():
+            return cached[0]
+        try:
+            price = binary_calls.get_gas_price(
+                denom=chain['denom'], node=chain['node_url'], binary=chain['binary'])
+        except (KeyError, ValueError, TimeoutError, subprocess.CalledProcessError):
+            price = float(chain['gas_price'])
+        price = max(price, float(chain.get('gas_price', 0)))
+        self._prices[chain['chain_id']] = (price, time.time() + _ttl(chain))
+        return price
+
+    def fees(self, chain: dict, gas: int) -> str:
+        """
+        Returns the fees for the given gas limit, e.g. 1250uatom
+        """
+        return f'{math.ceil(gas * self.gas_price(chain))}{chain["denom"]}'
+
+    def raise_fees(self, chain: dict, gas: int, log: str) -> str:
+        """
+        Returns the fees to resend with after an insufficient-fee rejection.
+        The gas price is raised to cover the fee required in the log,
+        or by fee_retry_factor if the log does not state it.
+        """
+        required = required_fee(log, chain['denom'])
+        if required is not None:
+            price = required / gas
+        else:
+            price = self.gas_price(chain) * float(chain.get('fee_retry_factor', FEE_RETRY_FACTOR))
+        self._prices[chain['chain_id']] = (price, time.time() + _ttl(chain))
+        return self.fees(chain, gas)
+
+
+def required_fee(log: str, denom: str) -> Optional[float]:
+    """
+    Amount of denom required by an insufficient-fee rejection,
+    e.g. 'insufficient fees; got: 10uatom required: 25uatom'
+    """
+    match = REQUIRED_FEE.search(log or '')
+    if match is None:
+        return None
+    for coin in match.group(1).split(','):
+        amount = re.fullmatch(r'(\d+(?:\.\d+)?)(.+)', coin)
+        if amount is not None and amount.group(2) == denom:
+            return float(amount.group(1))
+    return None
+
+
+def _ttl(chain: dict) -> float:
+    """
+    Seconds the cached values for a chain stay valid
+    """
+    return float(chain.get('gas_cache_ttl', DEFAULT_TTL))
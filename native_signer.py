@@ -0,0 +1,251 @@
+"""
+In-process signing for MsgSend transactions
+- the faucet key is exported from the test keyring once at startup
+- transactions are encoded as protobuf and signed with SIGN_MODE_DIRECT
+- signed transactions are broadcast through rpc_calls
+"""
+
+import asyncio
+import hashlib
+import logging
+import re
+from typing import Optional, Tuple
+
+from ecdsa import SECP256k1, SigningKey
+from ecdsa.util import sigencode_string_canonize
+
+import binary_calls
+from rpc_calls import RpcClient
+
+DEFAULT_GAS_LIMIT = 200000  # Same default as the binary
+SIGN_MODE_DIRECT = 1
+CODE_WRONG_SEQUENCE = 32  # ErrWrongSequence in the SDK
+MSG_SEND_TYPE = '/cosmos.bank.v1beta1.MsgSend'
+PUBKEY_TYPE = '/cosmos.crypto.secp256k1.PubKey'
+BECH32_CHARSET = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+
+
+def _varint(value: int) -> bytes:
+    """
+    Protobuf base 128 varint
+    """
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _field_bytes(number: int, value: bytes) -> bytes:
+    """
+    Length-delimited field, omitted when empty
+    """
+    if not value:
+        return b''
+    return _varint(number << 3 | 2) + _varint(len(value)) + value
+
+
+def _field_string(number: int, value: str) -> bytes:
+    """
+    String field, omitted when empty
+    """
+    return _field_bytes(number, value.encode())
+
+
+def _field_varint(number: int, value: int) -> bytes:
+    """
+    Varint field, omitted when zero
+    """
+    if not value:
+        return b''
+    return _varint(number << 3) + _varint(value)
+
+
+def _any(type_url: str, value: bytes) -> bytes:
+    """
+    google.protobuf.Any
+    """
+    return _field_string(1, type_url) + _field_bytes(2, value)
+
+
+def _coin(coin: str) -> bytes:
+    """
+    Encode a coin string such as 1000uatom
+    """
+    match = re.fullmatch(r'(\d+)(\S+)', coin)
+    if match is None:
+        raise ValueError(f'Invalid coin: {coin}')
+    return _field_string(1, match.group(2)) + _field_string(2, match.group(1))
+
+
+def _bech32_polymod(values: list) -> int:
+    """
+    BIP-173 checksum polynomial
+    """
+    generator = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
+    checksum = 1
+    for value in values:
+        top = checksum >> 25
+        checksum = (checksum & 0x1ffffff) << 5 ^ value
+        for index in range(5):
+            checksum ^= generator[index] if (top >> index) & 1 else 0
+    return checksum
+
+
+def bech32_encode(prefix: str, data: bytes) -> str:
+    """
+    Bech32 string for bytes, e.g. an account address
+    """
+    words, acc, bits = [], 0, 0
+    for byte in data:
+        acc = acc << 8 | byte
+        bits += 8
+        while bits >= 5:
+            bits -= 5
+            words.append(acc >> bits & 31)
+    if bits:
+        words.append(acc << (5 - bits) & 31)
+    expanded = [ord(char) >> 5 for char in prefix] + [0] + [ord(char) & 31 for char in prefix]
+    polymod = _bech32_polymod(expanded + words + [0] * 6) ^ 1
+    checksum = [polymod >> 5 * (5 - index) & 31 for index in range(6)]
+    return prefix + '1' + ''.join(BECH32_CHARSET[word] for word in words + checksum)
+
+
+def pubkey_address(pubkey: bytes, prefix: str) -> Optional[str]:
+    """
+    Account address of a compressed secp256k1 public key,
+    or None if this Python build has no RIPEMD-160
+    """
+    try:
+        ripemd = hashlib.new('ripemd160', hashlib.sha256(pubkey).digest())
+    except ValueError:
+        return None
+    return bech32_encode(prefix, ripemd.digest())
+
+
+def encode_msg_send(sender: str, recipient: str, amount: str) -> bytes:
+    """
+    cosmos.bank.v1beta1.MsgSend
+    """
+    return (_field_string(1, sender) +
+            _field_string(2, recipient) +
+            _field_bytes(3, _coin(amount)))
+
+
+def encode_tx_body(messages: list, memo: str = '') -> bytes:
+    """
+    cosmos.tx.v1beta1.TxBody, messages are (type URL, bytes) pairs
+    """
+    body = b''.join(_field_bytes(1, _any(type_url, value))
+                    for type_url, value in messages)
+    return body + _field_string(2, memo)
+
+
+def encode_auth_info(pubkey: bytes, sequence: int, fees: str, gas_limit: int) -> bytes:
+    """
+    cosmos.tx.v1beta1.AuthInfo with a single secp256k1 signer
+    """
+    mode_info = _field_bytes(1, _field_varint(1, SIGN_MODE_DIRECT))
+    signer_info = (_field_bytes(1, _any(PUBKEY_TYPE, _field_bytes(1, pubkey))) +
+                   _field_bytes(2, mode_info) +
+                   _field_varint(3, sequence))
+    fee = _field_bytes(1, _coin(fees)) + _field_varint(2, gas_limit)
+    return _field_bytes(1, signer_info) + _field_bytes(2, fee)
+
+
+def encode_sign_doc(body: bytes, auth_info: bytes, chain_id: str, account_number: int) -> bytes:
+    """
+    cosmos.tx.v1beta1.SignDoc
+    """
+    return (_field_bytes(1, body) +
+            _field_bytes(2, auth_info) +
+            _field_string(3, chain_id) +
+            _field_varint(4, account_number))
+
+
+def encode_tx_raw(body: bytes, auth_info: bytes, signature: bytes) -> bytes:
+    """
+    cosmos.tx.v1beta1.TxRaw
+    """
+    return (_field_bytes(1, body) +
+            _field_bytes(2, auth_info) +
+            _field_bytes(3, signature))
+
+
+class NativeSigner():
+    """
+    Builds, signs and broadcasts MsgSend transactions for one chain
+    """
+
+    def __init__(self, chain: dict):
+        self._chain_id = chain['chain_id']
+        self._binary = chain['binary']
+        self._node = chain['node_url']
+        self._address = chain['faucet_address']
+        self._gas_limit = int(chain.get('gas_limit', DEFAULT_GAS_LIMIT))
+        key_hex = binary_calls.export_private_key(
+            key_name=chain['faucet_key'], home=chain['home_folder'], binary=self._binary)
+        self._key = SigningKey.from_string(bytes.fromhex(key_hex), curve=SECP256k1)
+        self._pubkey = self._key.get_verifying_key().to_string('compressed')
+        address = pubkey_address(self._pubkey, self._address.rsplit('1', 1)[0])
+        if address is None:
+            logging.warning('Cannot check that %s belongs to %s without RIPEMD-160',
+                            chain['faucet_key'], self._address)
+        elif address != self._address:
+            raise ValueError(f'Key {chain["faucet_key"]} is for {address}, not {self._address}')
+        self._rpc = RpcClient(self._node)
+        self._account_number = None
+        self._sequence = None
+        self.sync_account()
+
+    def sync_account(self) -> None:
+        """
+        Read the account number and sequence from the chain
+        """
+        self._account_number, self._sequence = binary_calls.get_account(
+            address=self._address, node=self._node, binary=self._binary)
+        logging.info('Native signer for %s at account %s, sequence %s',
+                     self._chain_id, self._account_number, self._sequence)
+
+    def sign_send(self, request: dict, gas_limit: Optional[int] = None) -> Tuple[bytes, str]:
+        """
+        Returns the signed transaction bytes and its hash
+        for a request built by _build_transaction_request
+        """
+        body = encode_tx_body([(MSG_SEND_TYPE, encode_msg_send(
+            request['sender'], request['recipient'], request['amount']))])
+        auth_info = encode_auth_info(self._pubkey, self._sequence, request['fees'],
+                                     gas_limit or self._gas_limit)
+        sign_doc = encode_sign_doc(body, auth_info, self._chain_id, self._account_number)
+        signature = self._key.sign_deterministic(sign_doc, hashfunc=hashlib.sha256,
+                                                 sigencode=sigencode_string_canonize)
+        tx_bytes = encode_tx_raw(body, auth_info, signature)
+        return tx_bytes, hashlib.sha256(tx_bytes).hexdigest().upper()
+
+    async def tx_send(self, request: dict) -> Optional[str]:
+        """
+        Same contract as binary_calls.tx_send:
+        returns the transaction hash, or None if the node rejected it
+        """
+        return (await self.tx_send_with_code(request))[0]
+
+    async def tx_send_with_code(self, request: dict) -> Tuple[Optional[str], int, str]:
+        """
+        Same contract as binary_calls.tx_send_with_code:
+        returns (transaction hash, 0, '') or (None, error code, log)
+        """
+        tx_bytes, tx_hash = self.sign_send(request, gas_limit=request.get('gas'))
+        response = await self._rpc.broadcast_tx_sync(tx_bytes)
+        code = int(response.get('code', 0))
+        if code != 0:
+            log = response.get('log', '')
+            logging.error('Transaction failed with code %s: %s', code, log)
+            if code == CODE_WRONG_SEQUENCE:
+                await asyncio.to_thread(self.sync_account)
+            return None, code, log
+        self._sequence += 1
+        return response.get('hash', tx_hash), 0, ''
@@ -0,0 +1,131 @@
+"""
+On-demand profiling for the running bot
+- a sampling profiler for the event loop thread
+- a watchdog that reports event-loop steps blocking longer than a threshold
+Both write flamegraph-compatible collapsed-stack files.
+Nothing runs until a profiling session is started.
+"""
+
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Optional
+
+DEFAULT_INTERVAL = 0.005  # Seconds between stack samples
+
+
+def _collapse(frame) -> str:
+    """
+    Collapsed-stack form of a frame, outermost call first
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class LoopProfiler():
+    """
+    Samples the event loop thread for a fixed time and reports blocking steps
+    """
+
+    def __init__(self, output_dir: str = '.', slow_callback: float = 0.1,
+                 interval: float = DEFAULT_INTERVAL):
+        self._output_dir = output_dir
+        self._slow_callback = slow_callback
+        self._interval = interval
+        self._running = False
+        self._loop_thread = None
+        self._sampler = None
+        self._heartbeat = 0.0
+        self._samples = collections.Counter()
+        self._blocking = collections.Counter()
+        self._paths = None
+
+    @property
+    def running(self) -> bool:
+        """
+        True while a profiling session is in progress
+        """
+        return self._running
+
+    def start(self, duration: float) -> Optional[tuple]:
+        """
+        Start a session from the event loop thread.
+        Returns the paths the results will be written to,
+        or None if a session is already running.
+        """
+        if self._running:
+            return None
+        loop = asyncio.get_running_loop()
+        stamp = time.strftime('%Y%m%dT%H%M%S')
+        self._paths = tuple(os.path.join(self._output_dir, f'{kind}-{os.getpid()}-{stamp}.folded')
+                            for kind in ('profile', 'blocking'))
+        self._running = True
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.perf_counter()
+        self._samples.clear()
+        self._blocking.clear()
+        loop.create_task(self._beat())
+        self._sampler = threading.Thread(target=self._sample, name='faucet-profiler', daemon=True)
+        self._sampler.start()
+        loop.call_later(duration, self.stop)
+        logging.info('Profiling for %s seconds', duration)
+        return self._paths
+
+    def stop(self) -> None:
+        """
+        End the session and write the collapsed stacks
+        """
+        if not self._running:
+            return
+        self._running = False
+        # The sampler must be done with the counters before they are written
+        self._sampler.join()
+        try:
+            for path, counter in zip(self._paths, (self._samples, self._blocking)):
+                with open(path, 'w', encoding='utf-8') as folded:
+                    folded.writelines(f'{stack} {count}\n' for stack, count in counter.most_common())
+        except OSError as ex:
+            logging.error('Could not write profile: %s', ex)
+            return
+        logging.info('Profile written to %s, blocking stacks to %s', *self._paths)
+
+    async def _beat(self) -> None:
+        """
+        Mark that the event loop is still turning
+        """
+        while self._running:
+            self._heartbeat = time.perf_counter()
+            await asyncio.sleep(self._slow_callback / 4)
+
+    def _sample(self) -> None:
+        """
+        Sample the event loop thread until the session ends
+        """
+        blocked_since = None
+        blocked_stack = None
+        while self._running:
+            # pylint: disable=protected-access
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                stack = _collapse(frame)
+                self._samples[stack] += 1
+                stalled = time.perf_counter() - self._heartbeat
+                if stalled > self._slow_callback:
+                    self._blocking[stack] += 1
+                    if blocked_since is None:
+                        blocked_since, blocked_stack = self._heartbeat, stack
+                elif blocked_since is not None:
+                    logging.warning('Event loop blocked for %.0f ms in %s',
+                                    (self._heartbeat - blocked_since) * 1000,
+                                    blocked_stack.rsplit(';', 1)[-1])
+                    blocked_since = None
+            del frame
+            time.sleep(self._interval)
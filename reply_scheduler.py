@@ -0,0 +1,162 @@
+"""
+Outbound Discord reply scheduler
+- one queue per channel, token requests are sent before informational replies
+- sends are paced to stay within the per-channel rate limit
+- short informational replies queued for the same channel are merged
+"""
+
+import asyncio
+import collections
+import contextvars
+import itertools
+import logging
+import time
+
+import discord
+
+PRIORITY_REQUEST = 0
+PRIORITY_INFO = 1
+MESSAGE_LIMIT = 2000  # Discord message length limit
+
+
+class ReplyScheduler():
+    """
+    Queues replies per channel and sends them in priority order
+    """
+
+    def __init__(self, rate: int = 5, per: float = 5.0,
+                 merge: bool = True, merge_length: int = 300):
+        self._rate = rate
+        self._per = per
+        self._merge = merge
+        self._merge_length = merge_length
+        self._queues = {}  # channel ID -> PriorityQueue
+        self._drains = {}  # channel ID -> task sending the queued replies
+        self._sent = collections.defaultdict(
+            lambda: collections.deque(maxlen=rate))  # channel ID -> recent send times
+        self._order = itertools.count()
+        self._latency_sum = 0.0
+        self._latency_max = 0.0
+        self._sent_count = 0
+
+    async def reply(self, message, content: str, priority: int = PRIORITY_INFO):
+        """
+        Queue a reply to a message and return the sent Discord message
+        """
+        channel_id = message.channel.id
+        if channel_id not in self._queues:
+            self._queues[channel_id] = asyncio.PriorityQueue()
+            self._start_drain(channel_id, message.channel)
+        future = asyncio.get_running_loop().create_future()
+        await self._queues[channel_id].put(
+            (priority, next(self._order), message, content, time.monotonic(), future))
+        return await future
+
+    def metrics(self) -> dict:
+        """
+        Queue depth per channel and send latency in seconds
+        """
+        return {
+            'queue_depth': {str(channel_id): queue.qsize()
+                            for channel_id, queue in self._queues.items()},
+            'send_latency_seconds_sum': self._latency_sum,
+            'send_latency_seconds_count': self._sent_count,
+            'send_latency_seconds_max': self._latency_max,
+        }
+
+    def _start_drain(self, channel_id: int, channel) -> None:
+        """
+        Send a channel's queued replies in a task that is restarted if it stops
+        """
+        # The drain outlives the request that started it, so it must not keep its request ID
+        task = asyncio.get_running_loop().create_task(self._drain(channel_id, channel),
+                                                      context=contextvars.Context())
+        self._drains[channel_id] = task
+
+        def restart(done: asyncio.Task) -> None:
+            if done.cancelled():
+                return
+            logging.error('Reply queue for channel %s stopped: %r, restarting it',
+                          channel_id, done.exception())
+            self._start_drain(channel_id, channel)
+        task.add_done_callback(restart)
+
+    def _mergeable(self, item: tuple) -> bool:
+        """
+        Only short informational replies are merged
+        """
+        return (self._merge and item[0] == PRIORITY_INFO and
+                len(item[3]) <= self._merge_length)
+
+    async def _drain(self, channel_id: int, channel) -> None:
+        """
+        Send the queued replies for one channel
+        """
+        queue = self._queues[channel_id]
+        while True:
+            batch = [await queue.get()]
+            try:
+                await self._pace(channel_id)
+                # Higher priority replies may have been queued while waiting
+                queue.put_nowait(batch[0])
+                batch = [queue.get_nowait()]
+                if self._mergeable(batch[0]):
+                    batch.extend(self._take_mergeable(queue, batch[0]))
+                if len(batch) == 1:
+                    _, _, message, content, _, _ = batch[0]
+                    sent = await message.reply(content)
+                else:
+                    sent = await channel.send(
+                        '\n'.join(f'{item[2].author.mention} {item[3]}' for item in batch),
+                        allowed_mentions=discord.AllowedMentions(users=True))
+            except discord.HTTPException as ex:
+                logging.error('Could not send reply in channel %s: %s', channel_id, ex)
+                sent = None
+            except Exception as ex:  # pylint: disable=broad-except
+                # The replies waiting on this batch must always be resolved
+                logging.exception('Unexpected error sending reply in channel %s: %s',
+                                  channel_id, ex)
+                sent = None
+            self._sent[channel_id].append(time.monotonic())
+            self._record(batch, sent)
+
+    def _take_mergeable(self, queue: asyncio.PriorityQueue, first: tuple) -> list:
+        """
+        Take the queued replies that fit in one message with the first one
+        """
+        taken, kept = [], []
+        length = len(first[2].author.mention) + len(first[3]) + 1
+        while not queue.empty():
+            item = queue.get_nowait()
+            item_length = len(item[2].author.mention) + len(item[3]) + 2
+            if self._mergeable(item) and length + item_length <= MESSAGE_LIMIT:
+                taken.append(item)
+                length += item_length
+            else:
+                kept.append(item)
+        for item in kept:
+            queue.put_nowait(item)
+        return taken
+
+    async def _pace(self, channel_id: int) -> None:
+        """
+        Wait until the channel has room in its rate-limit bucket
+        """
+        sent = self._sent[channel_id]
+        if len(sent) == self._rate:
+            wait = sent[0] + self._per - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+    def _record(self, batch: list, sent) -> None:
+        """
+        Resolve the waiting replies and update the latency metrics
+        """
+        now = time.monotonic()
+        for _, _, _, _, queued_at, future in batch:
+            latency = now - queued_at
+            self._latency_sum += latency
+            self._latency_max = max(self._latency_max, latency)
+            self._sent_count += 1
+            if not future.done():
+                future.set_result(sent)
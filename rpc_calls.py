@@ -0,0 +1,90 @@
+"""
+node RPC utility functions
+- broadcast tx (sync)
+- node status
+- tx search
+
+Calls share one pooled HTTP session per node.
+"""
+
+import base64
+import itertools
+import logging
+
+import aiohttp
+
+import tracing
+
+DEFAULT_TIMEOUT = 10  # Seconds allowed for a single RPC call
+
+
+class RpcClient():
+    """
+    JSON-RPC client for a CometBFT node
+    """
+
+    def __init__(self, node: str, timeout: float = DEFAULT_TIMEOUT):
+        self._node = node.rstrip('/')
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session = None
+        self._ids = itertools.count()
+
+    async def call(self, method: str, **params) -> dict:
+        """
+        Call an RPC method and return its result
+        """
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=self._timeout)
+        payload = {'jsonrpc': '2.0', 'id': next(self._ids),
+                   'method': method, 'params': params}
+        try:
+            with tracing.span(f'rpc {method}'):
+                async with self._session.post(self._node, json=payload) as response:
+                    response.raise_for_status()
+                    body = await response.json(content_type=None)
+        except aiohttp.ClientError as err:
+            logging.error('RPC call %s to %s failed: %s', method, self._node, err)
+            raise ConnectionError(str(err)) from err
+        if 'error' in body:
+            logging.error('RPC call %s returned an error: %s', method, body['error'])
+            raise ValueError(body['error'])
+        return body['result']
+
+    async def broadcast_tx_sync(self, tx_bytes: bytes) -> dict:
+        """
+        broadcast_tx_sync <tx>
+        Returns the CheckTx result: code, log, codespace and hash
+        """
+        return await self.call('broadcast_tx_sync',
+                               tx=base64.b64encode(tx_bytes).decode())
+
+    async def latest_height(self) -> int:
+        """
+        status
+        Returns the latest block height
+        """
+        result = await self.call('status')
+        return int(result['sync_info']['latest_block_height'])
+
+    async def tx_search(self, query: str, per_page: int = 100) -> list:
+        """
+        tx_search <query>
+        Returns every matching transaction, fetching all result pages
+        """
+        txs = []
+        page = 1
+        while True:
+            result = await self.call('tx_search', query=query, prove=False,
+                                     page=str(page), per_page=str(per_page),
+                                     order_by='asc')
+            txs.extend(result['txs'])
+            if not result['txs'] or len(txs) >= int(result['total_count']):
+                return txs
+            page += 1
+
+    async def close(self) -> None:
+        """
+        Close the pooled session
+        """
+        if self._session is not None:
+            await self._session.close()
@@ -0,0 +1,334 @@
+"""
+Multi-process sharding for the faucet bot
+- the supervisor keeps the Discord connection and routes commands
+- each worker process owns a subset of chains or listening channels
+- rate limits and daily caps are coordinated through shared_state
+"""
+
+import asyncio
+import concurrent.futures
+import itertools
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from dataclasses import dataclass
+
+import tracing
+
+EVICTION_PERIOD = 3600  # Seconds between sweeps of expired time limits
+SHARD_BY_CHAIN = 'chain'
+SHARD_BY_CHANNEL = 'channel'
+JOB_TIMEOUT = 300  # Seconds a command may take on a worker before giving up
+WORKER_CHECK_PERIOD = 5  # Seconds between checks for workers that exited
+RESTART_BACKOFF = 1  # Seconds before the first restart of an exited worker, doubled each time
+RESTART_MAX_BACKOFF = 60  # A worker that ran this long is restarted without delay
+FAILED_REPLY = '❗ request could not be processed'
+
+
+@dataclass(frozen=True)
+class Requester:
+    """
+    Picklable stand-in for the Discord author of a command
+    """
+    id: int
+    name: str
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class WorkerPool():
+    """
+    Starts the worker processes and forwards commands to them
+    """
+
+    def __init__(self, config_path: str, workers: int, shard_by: str,
+                 chain_ids: list, channels: list):
+        if shard_by not in (SHARD_BY_CHAIN, SHARD_BY_CHANNEL):
+            raise ValueError(f'Unknown shard_by value: {shard_by}')
+        self._context = multiprocessing.get_context('spawn')
+        self._config_path = config_path
+        self._shard_by = shard_by
+        # Sends always go through the worker that owns the chain,
+        # so a faucet account is only used by one process
+        self._chain_routes = {name: index % workers for index, name in enumerate(sorted(chain_ids))}
+        self._routes = self._chain_routes if shard_by == SHARD_BY_CHAIN else \
+            {name: index % workers for index, name in enumerate(channels)}
+        self._outbox = self._context.Queue()
+        self._inboxes = [self._context.Queue() for _ in range(workers)]
+        self._chains = [(self._owned_chains(index, chain_ids), self._sending_chains(index, chain_ids))
+                        for index in range(workers)]
+        self._processes = [self._process(index) for index in range(workers)]
+        self._started_at = [0.0] * workers
+        self._restarts = [0] * workers
+        self._restart_at = [None] * workers  # Monotonic time of a scheduled restart
+        self._stopping = False
+        self._job_ids = itertools.count()
+        self._pending = {}
+        self._job_workers = {}
+        self._handles = {}
+        self._collector = None
+
+    def start(self) -> None:
+        """
+        Spawn the worker processes
+        """
+        for index, process in enumerate(self._processes):
+            process.start()
+            self._started_at[index] = time.monotonic()
+        for name, index in sorted(self._routes.items()):
+            logging.info('%s %s is served by worker %s', self._shard_by, name, index)
+
+    def stop(self) -> None:
+        """
+        Ask the workers to exit and wait for them
+        """
+        self._stopping = True
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+
+    def _process(self, index: int):
+        """
+        A new, unstarted process for a worker
+        """
+        owned_chains, sending_chains = self._chains[index]
+        return self._context.Process(target=worker_main,
+                                     args=(index, self._config_path, owned_chains, sending_chains,
+                                           self._inboxes[index], self._outbox),
+                                     name=f'faucet-worker-{index}',
+                                     daemon=True)
+
+    def _sending_chains(self, index: int, chain_ids: list) -> list:
+        """
+        Chains a worker sends tokens for, the only ones it loads keys for
+        """
+        return [chain_id for chain_id in chain_ids if self._chain_routes[chain_id] == index]
+
+    def _owned_chains(self, index: int, chain_ids: list) -> list:
+        """
+        Chains a worker serves, every chain when sharding by channel
+        """
+        if self._shard_by == SHARD_BY_CHANNEL:
+            return list(chain_ids)
+        return self._sending_chains(index, chain_ids)
+
+    def route(self, chain_id: str, channel: str, command: str) -> int:
+        """
+        Returns the index of the worker that serves the chain or channel.
+        $request is always routed by chain.
+        """
+        if self._shard_by == SHARD_BY_CHAIN or command == '$request':
+            return self._chain_routes.get(chain_id, 0)
+        return self._routes.get(channel, 0)
+
+    async def submit(self, chain_id: str, channel: str, command: str,
+                     message_sections: list, requester: Requester, handle=None):
+        """
+        Run a command on the worker that owns it and return its reply.
+        Later updates to the reply from the worker are applied through handle.
+        """
+        loop = asyncio.get_running_loop()
+        self.watch()
+        index = self.route(chain_id, channel, command)
+        if not self._processes[index].is_alive():
+            logging.error('Worker %s is not running, dropping %s', index, command)
+            return FAILED_REPLY
+        job_id = next(self._job_ids)
+        future = loop.create_future()
+        self._pending[job_id] = future
+        self._job_workers[job_id] = index
+        if handle is not None:
+            self._handles[job_id] = handle
+        self._inboxes[index].put(
+            (job_id, command, chain_id, message_sections, requester, tracing.current_context()))
+        try:
+            return await asyncio.wait_for(future, JOB_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.error('Worker %s did not answer %s in %s seconds', index, command, JOB_TIMEOUT)
+            self._pending.pop(job_id, None)
+            self._job_workers.pop(job_id, None)
+            self._handles.pop(job_id, None)
+            return FAILED_REPLY
+
+    def watch(self) -> None:
+        """
+        Start collecting results and supervising the workers.
+        Must be called from the running event loop.
+        """
+        if self._collector is None:
+            self._collector = threading.Thread(target=self._collect,
+                                               args=(asyncio.get_running_loop(),),
+                                               name='faucet-collector', daemon=True)
+            self._collector.start()
+
+    def _collect(self, loop) -> None:
+        """
+        Resolve pending commands as the workers reply, and check the workers periodically.
+        Runs in a daemon thread so a blocking read never holds up shutdown.
+        """
+        checked = time.monotonic()
+        while True:
+            try:
+                item = self._outbox.get(timeout=WORKER_CHECK_PERIOD)
+            except queue.Empty:
+                item = None
+            if time.monotonic() - checked >= WORKER_CHECK_PERIOD:
+                checked = time.monotonic()
+                loop.call_soon_threadsafe(self._check_workers)
+            if item is None:
+                continue
+            kind, job_id, *payload = item
+            if kind == 'result':
+                loop.call_soon_threadsafe(self._resolve, job_id, *payload)
+            elif kind == 'edit':
+                loop.call_soon_threadsafe(self._edit, job_id, *payload)
+
+    def _resolve(self, job_id: int, result, tracked: bool) -> None:
+        """
+        Hand a worker result to the command waiting for it
+        """
+        if not tracked:
+            self._handles.pop(job_id, None)
+        self._job_workers.pop(job_id, None)
+        future = self._pending.pop(job_id, None)
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    def _check_workers(self) -> None:
+        """
+        Answer the commands that were sent to a worker that has since exited,
+        then restart the worker with a backoff
+        """
+        if self._stopping:
+            return
+        for job_id, index in list(self._job_workers.items()):
+            if not self._processes[index].is_alive():
+                logging.error('Worker %s exited with job %s in flight', index, job_id)
+                self._handles.pop(job_id, None)
+                self._resolve(job_id, FAILED_REPLY, False)
+        now = time.monotonic()
+        for index, process in enumerate(self._processes):
+            if process.is_alive():
+                continue
+            if self._restart_at[index] is None:
+                if now - self._started_at[index] >= RESTART_MAX_BACKOFF:
+                    self._restarts[index] = 0
+                delay = min(RESTART_BACKOFF * 2 ** self._restarts[index], RESTART_MAX_BACKOFF)
+                self._restart_at[index] = now + delay
+                logging.error('Worker %s exited with code %s, restarting it in %s seconds',
+                              index, process.exitcode, delay)
+            if now >= self._restart_at[index]:
+                self._restart(index)
+
+    def _restart(self, index: int) -> None:
+        """
+        Start a new process for a worker, with the same chains and a new inbox
+        """
+        # A process killed while reading keeps the inbox's read lock, so the old
+        # inbox cannot be reused. Jobs left in it were already answered with an error.
+        self._inboxes[index].close()
+        self._inboxes[index] = self._context.Queue()
+        self._processes[index] = self._process(index)
+        self._processes[index].start()
+        self._started_at[index] = time.monotonic()
+        self._restarts[index] += 1
+        self._restart_at[index] = None
+        logging.warning('Worker %s restarted (restart %s)', index, self._restarts[index])
+
+    def _edit(self, job_id: int, content: str) -> None:
+        """
+        Apply a worker's update to a reply that was already sent
+        """
+        handle = self._handles.pop(job_id, None)
+        if handle is not None:
+            asyncio.get_running_loop().create_task(handle.edit(content))
+
+
+class RemoteReplyHandle():
+    """
+    Worker-side reply handle, updates are forwarded to the supervisor
+    """
+
+    def __init__(self, job_id: int, outbox):
+        self.tracked = False
+        self._job_id = job_id
+        self._outbox = outbox
+
+    async def edit(self, content: str) -> None:
+        """
+        Ask the supervisor to replace the content of the reply
+        """
+        self._outbox.put(('edit', self._job_id, content))
+
+
+def worker_main(index: int, config_path: str, owned_chains: list, sending_chains: list,
+                inbox, outbox) -> None:
+    """
+    Entry point of a worker process.
+    Commands are served for owned_chains, tokens are only sent for sending_chains.
+    """
+    # Imported here so the supervisor module is loaded fresh in the child
+    import cosmos_discord_faucet as faucet  # pylint: disable=import-outside-toplevel
+    faucet.install_profiler_signal()
+    faucet.load_config(config_path)
+    faucet.initialize_signers(sending_chains)
+    logging.info('Worker %s started for %s', index, ', '.join(owned_chains))
+    asyncio.run(_serve(index, faucet, owned_chains, sending_chains, inbox, outbox))
+
+
+async def _serve(index: int, faucet, owned_chains: list, sending_chains: list,
+                 inbox, outbox) -> None:
+    """
+    Read jobs from the inbox and run each one as a separate task
+    """
+    loop = asyncio.get_running_loop()
+    # Inbox reads get their own thread so blocking queries cannot starve them
+    reader = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='faucet-inbox')
+    tasks = set()
+    faucet.initialize_trackers(sending_chains)
+    faucet.install_profiler_signal()
+    tasks.add(loop.create_task(faucet.preflight_chains(owned_chains)))
+    if index == 0:
+        tasks.add(loop.create_task(_evict_expired(faucet)))
+    while True:
+        job = await loop.run_in_executor(reader, inbox.get)
+        if job is None:
+            break
+        task = loop.create_task(_run_job(faucet, job, outbox))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    reader.shutdown(wait=False)
+    logging.info('Worker %s stopped', index)
+
+
+async def _run_job(faucet, job: tuple, outbox) -> None:
+    """
+    Dispatch a single command and send its result to the supervisor
+    """
+    job_id, command, chain_id, message_sections, requester, trace_context = job
+    trace = tracing.resume_request(trace_context, command)
+    handle = RemoteReplyHandle(job_id, outbox)
+    faucet.REPLY_HANDLE.set(handle)
+    try:
+        result = await faucet.dispatch_command(
+            command, faucet.chains[chain_id], message_sections, requester)
+    except Exception as ex:  # pylint: disable=broad-except
+        # The supervisor is waiting on this job, it must always get an answer
+        logging.error('Worker failed to run %s in %s: %s', command, chain_id, ex)
+        result = FAILED_REPLY
+    tracing.finish_request(trace)
+    outbox.put(('result', job_id, result, handle.tracked))
+
+
+async def _evict_expired(faucet) -> None:
+    """
+    Periodically drop expired time limits from the shared state
+    """
+    while True:
+        removed = faucet.SHARED_STATE.evict_expired()
+        logging.info('Evicted %s expired time limits', removed)
+        await asyncio.sleep(EVICTION_PERIOD)
@@ -0,0 +1,119 @@
+"""
+Faucet state shared between bot processes
+- per-user and per-address request time limits
+- daily tally per chain
+
+The state is kept in a SQLite database in WAL mode so several
+worker processes on the same host can coordinate.
+"""
+
+import datetime
+import sqlite3
+import time
+from typing import Optional, Tuple
+
+RESERVED = 'reserved'
+DAILY_CAP = 'daily_cap'
+TIME_LIMIT = 'time_limit'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS request_limits (
+    chain_id     TEXT NOT NULL,
+    entity       TEXT NOT NULL,
+    next_request REAL NOT NULL,
+    PRIMARY KEY (chain_id, entity)
+);
+CREATE TABLE IF NOT EXISTS daily_tally (
+    chain_id TEXT PRIMARY KEY,
+    day      TEXT NOT NULL,
+    tally    INTEGER NOT NULL
+);
+'''
+
+
+class SharedState():
+    """
+    Rate-limit and daily-cap bookkeeping backed by SQLite.
+    Every check-and-update runs in a single write transaction,
+    so concurrent workers cannot both reserve the last allowance.
+    """
+
+    def __init__(self, path: str, busy_timeout: float = 10.0):
+        self._conn = sqlite3.connect(path, timeout=busy_timeout,
+                                     isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+
+    def reserve(self, chain_id: str, requester: str, address: str,
+                delta: int, daily_cap: int, timeout: int,
+                now: Optional[float] = None) -> Tuple[str, Optional[float]]:
+        """
+        Check the daily cap and the time limits for requester and address,
+        and register the request if both pass.
+        Returns (RESERVED, None), (DAILY_CAP, None) or
+        (TIME_LIMIT, time of the next allowed request)
+        """
+        now = time.time() if now is None else now
+        today = datetime.datetime.today().date().isoformat()
+        cur = self._conn.cursor()
+        cur.execute('BEGIN IMMEDIATE')
+        try:
+            row = cur.execute('SELECT day, tally FROM daily_tally WHERE chain_id = ?',
+                              (chain_id,)).fetchone()
+            tally = row[1] if row is not None and row[0] == today else 0
+            if tally + delta > daily_cap:
+                cur.execute('ROLLBACK')
+                return DAILY_CAP, None
+
+            for entity in (str(requester), address):
+                row = cur.execute('SELECT next_request FROM request_limits '
+                                  'WHERE chain_id = ? AND entity = ?',
+                                  (chain_id, entity)).fetchone()
+                if row is not None and row[0] > now:
+                    cur.execute('ROLLBACK')
+                    return TIME_LIMIT, row[0]
+
+            cur.executemany('INSERT OR REPLACE INTO request_limits '
+                            '(chain_id, entity, next_request) VALUES (?, ?, ?)',
+                            [(chain_id, str(requester), now + timeout),
+                             (chain_id, address, now + timeout)])
+            cur.execute('INSERT OR REPLACE INTO daily_tally (chain_id, day, tally) '
+                        'VALUES (?, ?, ?)', (chain_id, today, tally + delta))
+            cur.execute('COMMIT')
+            return RESERVED, None
+        except sqlite3.Error:
+            cur.execute('ROLLBACK')
+            raise
+
+    def release(self, chain_id: str, requester: str, address: str, delta: int) -> None:
+        """
+        Undo a reservation after a failed transfer
+        """
+        cur = self._conn.cursor()
+        cur.execute('BEGIN IMMEDIATE')
+        try:
+            cur.executemany('DELETE FROM request_limits WHERE chain_id = ? AND entity = ?',
+                            [(chain_id, str(requester)), (chain_id, address)])
+            cur.execute('UPDATE daily_tally SET tally = MAX(tally - ?, 0) '
+                        'WHERE chain_id = ?', (delta, chain_id))
+            cur.execute('COMMIT')
+        except sqlite3.Error:
+            cur.execute('ROLLBACK')
+            raise
+
+    def evict_expired(self, now: Optional[float] = None) -> int:
+        """
+        Remove time limits that have already expired
+        Returns the number of rows removed
+        """
+        now = time.time() if now is None else now
+        cur = self._conn.execute('DELETE FROM request_limits WHERE next_request <= ?', (now,))
+        return cur.rowcount
+
+    def close(self) -> None:
+        """
+        Close the database connection
+        """
+        self._conn.close()
@@ -0,0 +1,96 @@
+"""
+Tests for gas estimation and the resend after a rejected transfer
+"""
+
+import asyncio
+
+import pytest
+
+import binary_calls
+import cosmos_discord_faucet as faucet
+import gas_estimator
+from shard_workers import Requester
+
+SIMULATED_GAS = 100000
+GAS_LIMIT = 130000  # Simulated gas times the default adjustment
+LOW_FEE_LOG = 'insufficient fees; got: 650uatom required: 975uatom: insufficient fee'
+
+
+def _chain() -> dict:
+    return {'chain_id': 'chain-1', 'binary': 'gaiad', 'node_url': 'node', 'home_folder': '/tmp',
+            'faucet_address': 'cosmos1faucet', 'amount_to_send': '5', 'denom': 'uatom',
+            'tx_fees': '1000', 'fee_mode': 'estimate', 'gas_price': '0.005',
+            'block_explorer_tx': ''}
+
+
+def test_required_fee():
+    assert gas_estimator.required_fee(LOW_FEE_LOG, 'uatom') == 975
+    assert gas_estimator.required_fee('got: 1stake required: 2stake,3.5uatom', 'uatom') == 3.5
+    assert gas_estimator.required_fee('required: 2stake', 'uatom') is None
+    assert gas_estimator.required_fee('out of gas', 'uatom') is None
+
+
+@pytest.fixture
+def sends(monkeypatch):
+    """
+    Fees of each send, answered in turn with the queued (code, log) results
+    """
+    simulations = []
+    sent = []
+    results = []
+
+    def simulate_send(request):
+        simulations.append(request)
+        return SIMULATED_GAS
+
+    async def send_transfer(chain, request):
+        sent.append(request['fees'])
+        code, log = results.pop(0)
+        return ('AAAA', 0, '') if code == 0 else (None, code, log)
+
+    async def log_transfer(*args):
+        pass
+
+    monkeypatch.setattr(binary_calls, 'simulate_send', simulate_send)
+    monkeypatch.setattr(binary_calls, 'get_gas_price', lambda **_: 0.005)
+    monkeypatch.setattr(faucet, 'GAS_ESTIMATOR', gas_estimator.GasEstimator())
+    monkeypatch.setattr(faucet, '_send_transfer', send_transfer)
+    monkeypatch.setattr(faucet, '_log_transfer', log_transfer)
+    return sent, results, simulations
+
+
+def _transfer() -> str:
+    return asyncio.run(faucet._execute_token_transfer(Requester(1, 'user'), 'cosmos1user', _chain(), 5))
+
+
+def test_insufficient_fee_pays_required_fee(sends):
+    sent, results, simulations = sends
+    results.extend([(gas_estimator.CODE_INSUFFICIENT_FEE, LOW_FEE_LOG), (0, '')])
+    assert _transfer() == '✅ Hash ID: AAAA'
+    assert sent == ['650uatom', '975uatom']
+    assert len(simulations) == 1
+    # The raised price is kept for the next send
+    assert faucet.GAS_ESTIMATOR.fees(_chain(), GAS_LIMIT) == '975uatom'
+
+
+def test_insufficient_fee_without_required_fee(sends):
+    sent, results, simulations = sends
+    results.extend([(gas_estimator.CODE_INSUFFICIENT_FEE, 'insufficient fee'), (0, '')])
+    _transfer()
+    assert sent == ['650uatom', '975uatom']
+    assert len(simulations) == 1
+
+
+def test_out_of_gas_simulates_again(sends):
+    sent, results, simulations = sends
+    results.extend([(gas_estimator.CODE_OUT_OF_GAS, 'out of gas'), (0, '')])
+    _transfer()
+    assert sent == ['650uatom', '650uatom']
+    assert len(simulations) == 2
+
+
+def test_retried_once(sends):
+    _, results, _ = sends
+    results.extend([(gas_estimator.CODE_INSUFFICIENT_FEE, LOW_FEE_LOG)] * 2)
+    with pytest.raises(RuntimeError):
+        _transfer()
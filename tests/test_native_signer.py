@@ -0,0 +1,203 @@
+"""
+Tests for the native signer
+- known-answer protobuf encodings
+- signing and broadcast against a local stand-in RPC endpoint
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import subprocess
+
+import pytest
+from aiohttp import web
+from ecdsa import SECP256k1, SigningKey
+
+import binary_calls
+import native_signer
+
+PRIVATE_KEY = '01' * 32
+PUBKEY = bytes([2] + [1] * 32)
+FAUCET_ADDRESS = native_signer.pubkey_address(
+    SigningKey.from_string(bytes.fromhex(PRIVATE_KEY), curve=SECP256k1)
+    .get_verifying_key().to_string('compressed'), 'cosmos')
+
+
+def test_encode_msg_send():
+    expected = (b'\x0a\x08cosmos1a' +
+                b'\x12\x08cosmos1b' +
+                b'\x1a\x0a' + b'\x0a\x05uatom' + b'\x12\x015')
+    assert native_signer.encode_msg_send('cosmos1a', 'cosmos1b', '5uatom') == expected
+
+
+def test_encode_tx_body():
+    msg = native_signer.encode_msg_send('cosmos1a', 'cosmos1b', '5uatom')
+    expected = (b'\x0a\x40' +
+                b'\x0a\x1c/cosmos.bank.v1beta1.MsgSend' + b'\x12\x20' + msg +
+                b'\x12\x02hi')
+    assert native_signer.encode_tx_body([(native_signer.MSG_SEND_TYPE, msg)], 'hi') == expected
+
+
+def test_encode_auth_info():
+    pubkey_any = b'\x0a\x1f/cosmos.crypto.secp256k1.PubKey' + b'\x12\x23' + b'\x0a\x21' + PUBKEY
+    signer_info = (b'\x0a\x46' + pubkey_any +
+                   b'\x12\x04' + b'\x0a\x02\x08\x01' +
+                   b'\x18\x05')
+    fee = (b'\x0a\x0b' + b'\x0a\x05uatom' + b'\x12\x0210' +
+           b'\x10\xc0\x9a\x0c')
+    expected = b'\x0a\x50' + signer_info + b'\x12\x11' + fee
+    assert native_signer.encode_auth_info(PUBKEY, 5, '10uatom', 200000) == expected
+
+
+def test_encode_sign_doc_and_tx_raw():
+    assert native_signer.encode_sign_doc(b'B', b'A', 'chain-1', 300) == \
+        b'\x0a\x01B' + b'\x12\x01A' + b'\x1a\x07chain-1' + b'\x20\xac\x02'
+    assert native_signer.encode_tx_raw(b'B', b'A', b'S') == \
+        b'\x0a\x01B' + b'\x12\x01A' + b'\x1a\x01S'
+
+
+def test_zero_fields_are_omitted():
+    assert native_signer.encode_sign_doc(b'B', b'A', 'chain-1', 0) == \
+        b'\x0a\x01B' + b'\x12\x01A' + b'\x1a\x07chain-1'
+
+
+def test_bech32_encode():
+    # Checksum vectors from BIP-173
+    assert native_signer.bech32_encode('a', b'') == 'a12uel5l'
+    every_word = int(''.join(f'{word:05b}' for word in range(32)), 2).to_bytes(20, 'big')
+    assert native_signer.bech32_encode('abcdef', every_word) == \
+        'abcdef1qpzry9x8gf2tvdw0s3jn54khce6mua7lmqqqxw'
+
+
+def test_pubkey_address():
+    # The secp256k1 generator point is the public key of private key 1
+    generator = bytes.fromhex('0279be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798')
+    assert native_signer.pubkey_address(generator, 'cosmos') == native_signer.bech32_encode(
+        'cosmos', bytes.fromhex('751e76e8199196d454941c45d1b3a323f1433bd6'))
+
+
+def test_address_mismatch(accounts):
+    with pytest.raises(ValueError):
+        _signer('http://127.0.0.1:1', address='cosmos1qqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqnrql8a')
+
+
+def test_invalid_coin():
+    with pytest.raises(ValueError):
+        native_signer.encode_msg_send('cosmos1a', 'cosmos1b', 'uatom')
+
+
+@pytest.fixture
+def accounts(monkeypatch):
+    """
+    Account number and sequence returned by each account sync
+    """
+    synced = [(7, 3)]
+    monkeypatch.setattr(binary_calls, 'export_private_key', lambda **_: PRIVATE_KEY)
+    monkeypatch.setattr(binary_calls, 'get_account', lambda **_: synced[-1])
+    return synced
+
+
+def _signer(node: str, address: str = FAUCET_ADDRESS) -> native_signer.NativeSigner:
+    return native_signer.NativeSigner({
+        'chain_id': 'chain-1', 'binary': 'gaiad', 'node_url': node,
+        'faucet_address': address, 'faucet_key': 'faucet',
+        'home_folder': '/tmp'})
+
+
+def _request() -> dict:
+    return {'sender': FAUCET_ADDRESS, 'recipient': 'cosmos1user',
+            'amount': '5uatom', 'fees': '10uatom'}
+
+
+def test_sign_send(accounts):
+    signer = _signer('http://127.0.0.1:1')
+    tx_bytes, tx_hash = signer.sign_send(_request())
+    assert tx_hash == hashlib.sha256(tx_bytes).hexdigest().upper()
+
+    body = native_signer.encode_tx_body([(native_signer.MSG_SEND_TYPE, native_signer.encode_msg_send(
+        FAUCET_ADDRESS, 'cosmos1user', '5uatom'))])
+    verifying_key = SigningKey.from_string(bytes.fromhex(PRIVATE_KEY), curve=SECP256k1).get_verifying_key()
+    auth_info = native_signer.encode_auth_info(verifying_key.to_string('compressed'), 3, '10uatom',
+                                               native_signer.DEFAULT_GAS_LIMIT)
+    sign_doc = native_signer.encode_sign_doc(body, auth_info, 'chain-1', 7)
+    signature = tx_bytes[-64:]
+    assert tx_bytes == native_signer.encode_tx_raw(body, auth_info, signature)
+    assert verifying_key.verify(signature, sign_doc, hashfunc=hashlib.sha256)
+    # Canonical low-S signature
+    assert int.from_bytes(signature[32:], 'big') <= SECP256k1.order // 2
+
+
+async def _broadcast(accounts, responses: list) -> tuple:
+    """
+    Send once per response through a stand-in RPC endpoint.
+    Returns the send results and the requests the endpoint received.
+    """
+    received = []
+
+    async def rpc(request):
+        payload = await request.json()
+        received.append(payload)
+        return web.json_response({'jsonrpc': '2.0', 'id': payload['id'],
+                                  **responses[len(received) - 1]})
+
+    app = web.Application()
+    app.router.add_post('/', rpc)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    signer = _signer(f'http://127.0.0.1:{port}')
+    try:
+        results = [await signer.tx_send_with_code(_request()) for _ in responses]
+    finally:
+        await signer._rpc.close()
+        await runner.cleanup()
+    return results, received, signer
+
+
+def test_broadcast_increments_sequence(accounts):
+    results, received, signer = asyncio.run(_broadcast(accounts, [
+        {'result': {'code': 0, 'hash': 'AAAA', 'log': ''}},
+        {'result': {'code': 0, 'hash': 'BBBB', 'log': ''}},
+    ]))
+    assert results == [('AAAA', 0, ''), ('BBBB', 0, '')]
+    assert [payload['method'] for payload in received] == ['broadcast_tx_sync'] * 2
+    first, second = (base64.b64decode(payload['params']['tx']) for payload in received)
+    assert native_signer._field_varint(3, 3) in first
+    assert native_signer._field_varint(3, 4) in second
+    assert signer._sequence == 5
+
+
+def test_wrong_sequence_resyncs(accounts):
+    accounts.append((7, 9))
+    results, _, signer = asyncio.run(_broadcast(accounts, [
+        {'result': {'code': native_signer.CODE_WRONG_SEQUENCE, 'hash': 'AAAA', 'log': 'mismatch'}},
+    ]))
+    assert results == [(None, native_signer.CODE_WRONG_SEQUENCE, 'mismatch')]
+    assert signer._sequence == 9
+
+
+def test_rpc_error(accounts):
+    with pytest.raises(ValueError):
+        asyncio.run(_broadcast(accounts, [{'error': {'code': -32603, 'message': 'failed'}}]))
+
+
+def _account_output(monkeypatch, account: dict) -> None:
+    completed = subprocess.CompletedProcess([], 0, stdout=json.dumps(account), stderr='')
+    monkeypatch.setattr(binary_calls, '_run', lambda *args, **kwargs: completed)
+
+
+def test_get_account(monkeypatch):
+    _account_output(monkeypatch, {'account': {
+        '@type': '/cosmos.vesting.v1beta1.DelayedVestingAccount',
+        'base_vesting_account': {'base_account': {
+            'address': 'cosmos1faucet', 'account_number': '12', 'sequence': '4'}}}})
+    assert binary_calls.get_account('cosmos1faucet', 'node', 'gaiad') == (12, 4)
+
+
+def test_get_account_without_number(monkeypatch):
+    _account_output(monkeypatch, {'account': {'address': 'cosmos1faucet'}})
+    with pytest.raises(KeyError):
+        binary_calls.get_account('cosmos1faucet', 'node', 'gaiad')
@@ -0,0 +1,88 @@
+"""
+Tests for the state shared between bot processes
+"""
+
+import pytest
+
+from shared_state import SharedState, RESERVED, DAILY_CAP, TIME_LIMIT
+
+NOW = 1_000_000.0
+TIMEOUT = 3600
+
+
+@pytest.fixture
+def state(tmp_path):
+    shared = SharedState(str(tmp_path / 'state.db'))
+    yield shared
+    shared.close()
+
+
+def _reserve(state, requester='user-1', address='cosmos1a', delta=10, cap=25, now=NOW):
+    return state.reserve('chain-1', requester, address, delta,
+                         daily_cap=cap, timeout=TIMEOUT, now=now)
+
+
+def test_reserve(state):
+    assert _reserve(state) == (RESERVED, None)
+
+
+def test_time_limit_per_requester_and_address(state):
+    _reserve(state)
+    assert _reserve(state, address='cosmos1b') == (TIME_LIMIT, NOW + TIMEOUT)
+    assert _reserve(state, requester='user-2') == (TIME_LIMIT, NOW + TIMEOUT)
+    assert _reserve(state, requester='user-2', address='cosmos1b') == (RESERVED, None)
+
+
+def test_time_limit_expires(state):
+    _reserve(state)
+    assert _reserve(state, now=NOW + TIMEOUT + 1) == (RESERVED, None)
+
+
+def test_time_limits_are_per_chain(state):
+    _reserve(state)
+    assert state.reserve('chain-2', 'user-1', 'cosmos1a', 10,
+                         daily_cap=25, timeout=TIMEOUT, now=NOW) == (RESERVED, None)
+
+
+def test_daily_cap(state):
+    _reserve(state, requester='user-1', address='cosmos1a')
+    _reserve(state, requester='user-2', address='cosmos1b')
+    assert _reserve(state, requester='user-3', address='cosmos1c') == (DAILY_CAP, None)
+
+
+def test_rejection_does_not_reserve(state):
+    _reserve(state, requester='user-1', address='cosmos1a')
+    _reserve(state, requester='user-2', address='cosmos1b')
+    assert _reserve(state, requester='user-3', address='cosmos1c') == (DAILY_CAP, None)
+    # user-3 was not registered by the rejected request
+    assert _reserve(state, requester='user-3', address='cosmos1c', delta=5) == (RESERVED, None)
+
+
+def test_release(state):
+    _reserve(state, requester='user-1', address='cosmos1a')
+    _reserve(state, requester='user-2', address='cosmos1b')
+    state.release('chain-1', 'user-1', 'cosmos1a', 10)
+    assert _reserve(state, requester='user-1', address='cosmos1a') == (RESERVED, None)
+    assert _reserve(state, requester='user-3', address='cosmos1c') == (DAILY_CAP, None)
+
+
+def test_day_rollover(state):
+    _reserve(state, requester='user-1', address='cosmos1a')
+    _reserve(state, requester='user-2', address='cosmos1b')
+    state._conn.execute("UPDATE daily_tally SET day = '2000-01-01'")
+    assert _reserve(state, requester='user-3', address='cosmos1c') == (RESERVED, None)
+
+
+def test_shared_between_connections(tmp_path, state):
+    other = SharedState(str(tmp_path / 'state.db'))
+    try:
+        _reserve(state)
+        assert _reserve(other, address='cosmos1b') == (TIME_LIMIT, NOW + TIMEOUT)
+    finally:
+        other.close()
+
+
+def test_evict_expired(state):
+    _reserve(state)
+    assert state.evict_expired(now=NOW) == 0
+    assert state.evict_expired(now=NOW + TIMEOUT) == 2
@@ -0,0 +1,139 @@
+"""
+Request-scoped tracing
+- every command gets a request ID, carried through contextvars
+- sampled requests record timed spans and are written to a JSON-lines file
+- the request ID is added to every log line
+"""
+
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from typing import Optional, Tuple
+
+REQUEST_ID = contextvars.ContextVar('request_id', default=None)
+CURRENT_TRACE = contextvars.ContextVar('current_trace', default=None)
+
+TRACES_PATH = None
+SAMPLE_RATE = 0.0
+
+
+class Trace():
+    """
+    Spans recorded for one request in one process
+    """
+
+    def __init__(self, request_id: str, name: Optional[str]):
+        self.request_id = request_id
+        self.name = name
+        self.start = time.time()
+        self._start = time.perf_counter()
+        self.spans = []
+
+    def add_span(self, name: str, start: float, end: float, **attributes) -> None:
+        """
+        Record a span, times are perf_counter values
+        """
+        self.spans.append(dict(name=name,
+                               offset_ms=round((start - self._start) * 1000, 3),
+                               duration_ms=round((end - start) * 1000, 3),
+                               **attributes))
+
+    def to_dict(self) -> dict:
+        """
+        JSON-serializable form of the finished trace
+        """
+        return {'request_id': self.request_id, 'name': self.name, 'pid': os.getpid(),
+                'start': self.start,
+                'duration_ms': round((time.perf_counter() - self._start) * 1000, 3),
+                'spans': self.spans}
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    Adds the current request ID to log records as request_id
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = REQUEST_ID.get() or '-'
+        return True
+
+
+def configure(traces_path: Optional[str], sample_rate: float) -> None:
+    """
+    Set the JSON-lines file for finished traces and the share of requests traced
+    """
+    global TRACES_PATH, SAMPLE_RATE
+    TRACES_PATH = traces_path or None
+    SAMPLE_RATE = sample_rate
+
+
+def start_request(name: Optional[str]) -> Optional[Trace]:
+    """
+    Assign a request ID and start a trace if the request is sampled.
+    Traces without a name, e.g. messages that are not commands, are not written.
+    """
+    request_id = uuid.uuid4().hex[:12]
+    sampled = TRACES_PATH is not None and random.random() < SAMPLE_RATE
+    return resume_request((request_id, sampled), name)
+
+
+def resume_request(context: Tuple[Optional[str], bool], name: Optional[str]) -> Optional[Trace]:
+    """
+    Continue a request started in another process
+    """
+    request_id, sampled = context
+    REQUEST_ID.set(request_id)
+    trace = Trace(request_id, name) if sampled and TRACES_PATH is not None else None
+    CURRENT_TRACE.set(trace)
+    return trace
+
+
+def current_context() -> Tuple[Optional[str], bool]:
+    """
+    Request ID and sampling decision to hand over to another process
+    """
+    return REQUEST_ID.get(), CURRENT_TRACE.get() is not None
+
+
+def rename(name: str) -> None:
+    """
+    Name the current trace once the command is known
+    """
+    trace = CURRENT_TRACE.get()
+    if trace is not None:
+        trace.name = name
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """
+    Time the enclosed block as a span of the current trace
+    """
+    trace = CURRENT_TRACE.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, start, time.perf_counter(), **attributes)
+
+
+def finish_request(trace: Optional[Trace]) -> None:
+    """
+    Append a finished trace to the traces file
+    """
+    if trace is None or trace.name is None:
+        return
+    try:
+        # Single append per trace, so lines from several processes do not interleave
+        with open(TRACES_PATH, 'a', encoding='utf-8') as traces_file:
+            traces_file.write(json.dumps(trace.to_dict()) + '\n')
+    except OSError as ex:
+        logging.error('Could not write trace %s: %s', trace.request_id, ex)